@@ -4,9 +4,15 @@ import argparse
 import yaml
 import os
 
-from src.calibrate_camera import calibrate_camera, save_camera_calibration
+from src.calibrate_camera import calibrate_camera, load_camera_calibration, save_camera_calibration
 from src.stereo_calibration import stereo_calibrate
 from src.calibrate_rectification import calibrate_rectification
+from src.chessboard_detection import detect_corners, find_chessboard
+from src.corner_cache import detect_corners_cached, image_hash
+from src.frame_selection import auto_select_frames
+from src.image_source import ImageSource, list_image_paths
+from src.instrumentation import add_instrumentation_arguments, enable_from_args, metrics
+from src.live_capture import live_select_frames
 
 # Load configuration from config.yaml
 def load_config(config_path='data/config.yaml'):
@@ -19,10 +25,9 @@ config = load_config()
 PATTERN_SIZE = (config['pattern_size']['width'], config['pattern_size']['height'])
 CHESSBOARD_SQUARE_SIZE = config['chessboard_square_size']
 
-def check_frame(frame):
+def check_frame(frame, max_dim=None):
     frame_copy = frame.copy()
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    success, corners = cv2.findChessboardCorners(gray, PATTERN_SIZE, None)
+    success, corners = find_chessboard(frame, PATTERN_SIZE, max_dim)
 
     if success:
         cv2.drawChessboardCorners(frame_copy, PATTERN_SIZE, corners, success)
@@ -40,18 +45,18 @@ def check_frame(frame):
         print("[WARNING]\tChessboard corners not detected.")
         return False
 
-def check_stereo_frame(frame):
+def check_stereo_frame(frame, max_dim=None):
     _, width = frame.shape[:2]
     left_image = frame[:, :width // 2]
     right_image = frame[:, width // 2:]
 
     print("[INFO]\tChecking left image...")
-    left_success = check_frame(left_image)
+    left_success = check_frame(left_image, max_dim)
     if not left_success:
         return False
 
     print("[INFO]\tChecking right image...")
-    right_success = check_frame(right_image)
+    right_success = check_frame(right_image, max_dim)
     if not right_success:
         return False
 
@@ -59,7 +64,7 @@ def check_stereo_frame(frame):
     print("[INFO]\tStereo frame accepted.")
     return True
 
-def extract_calib_frames(video_path, stereo, folder_path):
+def extract_calib_frames(video_path, stereo, folder_path, max_dim=None):
     cap = cv2.VideoCapture(video_path)
 
     if not cap.isOpened():
@@ -81,9 +86,9 @@ def extract_calib_frames(video_path, stereo, folder_path):
 
         if key == ord(' '):
             if stereo:
-                is_usable = check_stereo_frame(frame)
+                is_usable = check_stereo_frame(frame, max_dim)
             else:
-                is_usable = check_frame(frame)
+                is_usable = check_frame(frame, max_dim)
             if is_usable:
                 selected_frames.append(frame)
                 print(f"[INFO]\tFrame {frame_count} selected for processing.")
@@ -98,6 +103,33 @@ def extract_calib_frames(video_path, stereo, folder_path):
 
     print(f"[INFO]\tSelected frames for processing: {len(selected_frames)}")
 
+    save_calib_frames(selected_frames, stereo, folder_path)
+
+    return
+
+def auto_extract_calib_frames(video_path, stereo, folder_path, target_count, stride=5, max_dim=None, workers=None):
+    # Headless alternative to extract_calib_frames, keeps a pose-diverse subset of sharp frames
+    selected_frames = auto_select_frames(video_path, PATTERN_SIZE, stereo, target_count, stride, max_dim, workers)
+
+    if selected_frames is None:
+        return
+
+    print(f"[INFO]\tSelected frames for processing: {len(selected_frames)}")
+
+    save_calib_frames(selected_frames, stereo, folder_path)
+
+def live_extract_calib_frames(source, stereo, folder_path, target_count, detect_rate=5.0, max_dim=None, preview=True):
+    # Calibration frames straight from the rig, chosen while the chessboard is moved in front of the camera
+    selected_frames = live_select_frames(source, PATTERN_SIZE, stereo, target_count, detect_rate, max_dim, preview)
+
+    if selected_frames is None:
+        return
+
+    print(f"[INFO]\tSelected frames for processing: {len(selected_frames)}")
+
+    save_calib_frames(selected_frames, stereo, folder_path)
+
+def save_calib_frames(selected_frames, stereo, folder_path):
     if stereo:
         for i, frame in enumerate(selected_frames):
             _, width = frame.shape[:2]
@@ -112,30 +144,28 @@ def extract_calib_frames(video_path, stereo, folder_path):
             image_path = f"{folder_path}/frame_{i}.png"
             cv2.imwrite(image_path, frame)
 
-    return
-
-def load_images(folder_path, name):
-    images = []
-
-    counter = 0
-    while True:
-        file_name = f"{name}_{counter}.png"
-        file_path = os.path.join(folder_path, file_name)
-        
-        # Check if the file exists
-        if not os.path.isfile(file_path):
-            break
-        
-        # Load the image and append to the list
-        image = cv2.imread(file_path)
-        if image is not None:
-            images.append(image)
+def find_corners(images, cache_path, workers=None, max_dim=None, hashes=None, in_use=None):
+    # Only images that are not in the corner cache of this calibration set are decoded and searched
+    with metrics.stage("detection"):
+        if cache_path is None:
+            corner_set = detect_corners(images, PATTERN_SIZE, workers=workers, max_dim=max_dim)
         else:
-            print(f"[WARNING]\tFailed to load image: {file_path}")
-
-        counter += 1
-
-    return images
+            corner_set = detect_corners_cached(images.paths, PATTERN_SIZE, cache_path, workers=workers, max_dim=max_dim,
+                                               hashes=hashes, in_use=in_use)
+
+    metrics.count("images", len(corner_set))
+    metrics.count("boards_detected", corner_set.num_detected())
+    metrics.progress(len(corner_set))
+    return corner_set
+
+def previous_intrinsics(file_path):
+    # Intrinsics of an earlier run as initial guess for the incremental mode
+    previous = load_camera_calibration(file_path)
+    if previous is None:
+        print(f"[WARNING]\tNo previous calibration {file_path}, solving from scratch.")
+        return None
+    print(f"[INFO]\tStarting from the previous calibration {file_path} (error {previous[0]:.4f} px).")
+    return previous[1], previous[2]
 
 if __name__ == "__main__":
 
@@ -148,9 +178,27 @@ if __name__ == "__main__":
     parser.add_argument('-s', '--stereo', action='store_true', help="Enable stereo calibration mode")
     parser.add_argument('-f', '--folder', type=str, help=f"Specify path to the calibration images folder (default: {folder_path}/<name>), setting this overwrites the /<name> ending!")
     parser.add_argument('-n', '--name', type=str, help=f"Specify a name of this calibration (default: {name})")
+    parser.add_argument('-c', '--camera', type=str, help="Capture the calibration frames live from a camera device index or stream URL (a video file is played back in real time)")
+    parser.add_argument('-a', '--auto', type=int, metavar='N', help="Select up to N frames from the video automatically, without GUI; with --camera, stop after N frames (default: 30)")
+    parser.add_argument('--detect-rate', type=float, default=5.0, help="With --camera, maximum number of chessboard detections per second (default: 5)")
+    parser.add_argument('--no-preview', action='store_true', help="With --camera, do not show the preview window")
+    parser.add_argument('--stride', type=int, default=5, help="With --auto, only analyse every n-th video frame (default: 5)")
+    parser.add_argument('-j', '--workers', type=int, help="Number of processes used for chessboard detection (default: number of CPUs)")
+    parser.add_argument('-d', '--detect-dim', type=int, help="Search chessboards on a downscaled copy with this longest side in pixels and refine on the full image (default: full resolution)")
+    parser.add_argument('--no-cache', action='store_true', help="Do not read or write the chessboard corner cache (data/out/corners_<name>.npz)")
+    parser.add_argument('-p', '--prune', action='store_true', help="Iteratively drop outlier views and recalibrate (per-view errors are saved to data/out/reprojection_<name>[_left|_right].csv)")
+    parser.add_argument('--outlier-factor', type=float, default=2.0, help="With --prune, drop views with an error above this multiple of the median view error (default: 2.0)")
+    parser.add_argument('--max-view-error', type=float, help="With --prune, drop views with an error above this many pixels (default: no limit)")
+    parser.add_argument('-i', '--incremental', action='store_true', help="Start the intrinsic calibration from the previous one of this name (data/out/calibration_<name>*) instead of solving from scratch; with the corner cache only new images are searched")
+    add_instrumentation_arguments(parser)
 
     args = parser.parse_args()
 
+    if args.auto is not None and args.auto <= 0:
+        parser.error("argument -a/--auto: the number of frames has to be positive")
+
+    enable_from_args("calibration", args)
+
     if args.stereo:
         is_stereo = True
 
@@ -161,36 +209,76 @@ if __name__ == "__main__":
     if args.folder is not None:
         folder_path = args.folder
 
-    if args.video is not None:
+    if args.camera is not None:
+        os.makedirs(folder_path, exist_ok=True)
+        with metrics.stage("frame_selection"):
+            live_extract_calib_frames(args.camera, is_stereo, folder_path, args.auto or 30, args.detect_rate, args.detect_dim,
+                                      not args.no_preview)
+    elif args.video is not None:
         os.makedirs(folder_path, exist_ok=True)
-        extract_calib_frames(args.video, is_stereo, folder_path=folder_path)
+        with metrics.stage("frame_selection"):
+            if args.auto is not None:
+                auto_extract_calib_frames(args.video, is_stereo, folder_path, args.auto, args.stride, args.detect_dim, args.workers)
+            else:
+                extract_calib_frames(args.video, is_stereo, folder_path=folder_path, max_dim=args.detect_dim)
+
+    # Automatic frame selection runs without GUI, the calibration must not wait for key presses either
+    visualize = args.auto is None and not args.no_preview
+
+    cache_path = None if args.no_cache else f"data/out/corners_{name}.npz"
+    pruning = {'prune': args.prune, 'outlier_factor': args.outlier_factor, 'max_view_error': args.max_view_error}
+    if args.incremental and cache_path is None:
+        print("[WARNING]\tIncremental mode without corner cache, all images are searched again.")
 
     # Perform intrinsic calibration(s)
     if is_stereo:
-        left_images = load_images(folder_path, "left")
-
-        rmse_l, mtx_l, dist_l = calibrate_camera(left_images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, False)
+        # Detect the corners once, they are reused by the stereo calibration
+        left_images = ImageSource(list_image_paths(folder_path, "left"))
+        right_images = ImageSource(list_image_paths(folder_path, "right"))
+
+        # Both sides share the corner cache, each side keeps the entries of the other one
+        hashes_l = hashes_r = None
+        if cache_path is not None:
+            hashes_l = [image_hash(path) for path in left_images.paths]
+            hashes_r = [image_hash(path) for path in right_images.paths]
+
+        corners_l = find_corners(left_images, cache_path, args.workers, args.detect_dim, hashes_l, hashes_r)
+
+        initial_l = previous_intrinsics(f"data/out/calibration_{name}_left.txt") if args.incremental else None
+        with metrics.stage("solve"):
+            rmse_l, mtx_l, dist_l = calibrate_camera(left_images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, False, corner_set=corners_l,
+                                                     report_path=f"data/out/reprojection_{name}_left.csv", initial=initial_l, **pruning)
         save_camera_calibration(rmse_l, mtx_l, dist_l, f"data/out/calibration_{name}_left.txt")
 
-        right_images = load_images(folder_path, "right")
+        corners_r = find_corners(right_images, cache_path, args.workers, args.detect_dim, hashes_r, hashes_l)
 
-        rmse_r, mtx_r, dist_r = calibrate_camera(right_images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, False)
+        initial_r = previous_intrinsics(f"data/out/calibration_{name}_right.txt") if args.incremental else None
+        with metrics.stage("solve"):
+            rmse_r, mtx_r, dist_r = calibrate_camera(right_images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, False, corner_set=corners_r,
+                                                     report_path=f"data/out/reprojection_{name}_right.csv", initial=initial_r, **pruning)
         save_camera_calibration(rmse_r, mtx_r, dist_r, f"data/out/calibration_{name}_right.txt")
 
 
 
     else:
-        images = load_images(folder_path, "frame")
+        images = ImageSource(list_image_paths(folder_path, "frame"))
+        corners = find_corners(images, cache_path, args.workers, args.detect_dim)
 
-        rmse, mtx, dist = calibrate_camera(images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE)
+        initial = previous_intrinsics(f"data/out/calibration_{name}.txt") if args.incremental else None
+        with metrics.stage("solve"):
+            rmse, mtx, dist = calibrate_camera(images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, visualize, corner_set=corners,
+                                               report_path=f"data/out/reprojection_{name}.csv", initial=initial, **pruning)
         save_camera_calibration(rmse, mtx, dist, f"data/out/calibration_{name}.txt")
 
     
     # if stereo, perform extrinsic calibration
     if is_stereo:
-        R, T = stereo_calibrate(mtx_l, dist_l, mtx_r, dist_r, left_images, right_images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, True)
-        
-        w = left_images[0].shape[1]
-        h = left_images[0].shape[0]
+        # With the intrinsics fixed only R and T are solved, the solve starts from scratch in every mode
+        with metrics.stage("stereo_solve"):
+            R, T = stereo_calibrate(mtx_l, dist_l, mtx_r, dist_r, left_images, right_images, PATTERN_SIZE, CHESSBOARD_SQUARE_SIZE, visualize,
+                                    corner_set_l=corners_l, corner_set_r=corners_r)
+
+        with metrics.stage("rectification_maps"):
+            calibrate_rectification(mtx_l, dist_l, mtx_r, dist_r, corners_l.image_size, R, T, name)
 
-        calibrate_rectification(mtx_l, dist_l, mtx_r, dist_r, (w, h), R, T, name)
\ No newline at end of file
+    metrics.close()
\ No newline at end of file
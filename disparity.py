@@ -0,0 +1,101 @@
+import cv2
+import numpy as np
+
+import argparse
+import os
+
+from src.instrumentation import add_instrumentation_arguments, enable_from_args, metrics
+from src.parallel import resolve_workers
+from src.pipeline import Pipeline
+from src.stereo_matching import SGBM_MODES, DisparityMatcher
+
+def list_pairs(input_folder):
+    # Rectified pairs are numbered consecutively, stop at the first missing pair
+    counter = 0
+    while os.path.isfile(f"{input_folder}/rectified_left/rectified_left_image_{counter}.jpg") and \
+            os.path.isfile(f"{input_folder}/rectified_right/rectified_right_image_{counter}.jpg"):
+        yield counter
+        counter += 1
+
+def main(input_folder, output_folder, workers=None, io_threads=2, scale=1.0, num_disparities=128, block_size=5,
+         min_disparity=0, mode='sgbm', color=False):
+    """
+    Compute disparity maps of the rectified pairs written by rectification.py.
+
+    Args:
+    - input_folder: Output folder of rectification.py (with rectified_left/ and rectified_right/).
+    - output_folder: Folder for the disparity maps, saved as rectified_left_<N>.npy (float32 pixels,
+      NaN where no match was found) as expected by disparity_to_depth.py.
+    - workers: Number of matching threads, each with its own matcher (default: number of CPUs).
+    - io_threads: Number of threads reading and writing each (default: 2).
+    - scale: Match on images downscaled by this factor (default: 1.0).
+    - num_disparities, block_size, min_disparity, mode: StereoSGBM settings at full resolution.
+    - color: Match the colour images instead of grayscale (default: False).
+    """
+    workers = resolve_workers(workers)
+    os.makedirs(output_folder, exist_ok=True)
+
+    matcher = DisparityMatcher(scale, num_disparities, block_size, min_disparity, mode)
+    read_flag = cv2.IMREAD_COLOR if color else cv2.IMREAD_GRAYSCALE
+
+    def load_pair(counter):
+        img_l = cv2.imread(f"{input_folder}/rectified_left/rectified_left_image_{counter}.jpg", read_flag)
+        img_r = cv2.imread(f"{input_folder}/rectified_right/rectified_right_image_{counter}.jpg", read_flag)
+
+        if img_l is None or img_r is None:
+            print(f"[ERROR]\tFailed to load rectified pair {counter}")
+            return None
+        return counter, img_l, img_r
+
+    def match_pair(pair):
+        counter, img_l, img_r = pair
+        return counter, matcher.compute(img_l, img_r)
+
+    def save_disparity(result):
+        counter, disparity = result
+        np.save(f"{output_folder}/rectified_left_{counter}.npy", disparity)
+        return counter
+
+    # Reading, matching and writing run in separate thread pools connected by bounded queues
+    pipeline = Pipeline(queue_size=2 * workers)
+    pipeline.add_stage("read", load_pair, io_threads)
+    pipeline.add_stage("match", match_pair, workers)
+    pipeline.add_stage("write", save_disparity, io_threads)
+
+    counter = 0
+
+    print("[INFO]\tComputing disparity maps...\n")
+
+    for _ in pipeline.run(list_pairs(input_folder)):
+        counter += 1
+        metrics.progress()
+        if counter % 10 == 0:
+            print(f"      \t... Processed {counter} pairs...", end="\r")
+
+    print("                                                                                    ", end="\r")
+    print(f"[INFO]\t... Disparity computation of {counter} pairs complete!")
+    pipeline.print_stats()
+    metrics.record_pipeline(pipeline)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute disparity maps of rectified stereo pairs with StereoSGBM.")
+    parser.add_argument('-i', '--input', required=True, help="Output folder of rectification.py (containing rectified_left/ and rectified_right/).")
+    parser.add_argument('-o', '--output', required=True, help="Folder to save the disparity maps (rectified_left_<N>.npy) to.")
+    parser.add_argument('-w', '--workers', type=int, help="Number of matching threads (default: number of CPUs).")
+    parser.add_argument('--io-threads', type=int, default=2, help="Number of threads reading and writing each (default: 2).")
+    parser.add_argument('-s', '--scale', type=float, default=1.0, help="Match on images downscaled by this factor, e.g. 0.5 (default: 1.0).")
+    parser.add_argument('-d', '--num-disparities', type=int, default=128, help="Disparity search range in full-resolution pixels (default: 128).")
+    parser.add_argument('-b', '--block-size', type=int, default=5, help="Odd matched block size (default: 5).")
+    parser.add_argument('--min-disparity', type=int, default=0, help="Smallest searched disparity in full-resolution pixels (default: 0).")
+    parser.add_argument('-m', '--mode', choices=list(SGBM_MODES), default='sgbm', help="StereoSGBM mode (default: sgbm).")
+    parser.add_argument('-c', '--color', action='store_true', help="Match the colour images instead of grayscale.")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    enable_from_args("disparity", args)
+    main(args.input, args.output, args.workers, args.io_threads, args.scale, args.num_disparities, args.block_size,
+         args.min_disparity, args.mode, args.color)
+    metrics.close()
+
+# Example Usage:
+# python disparity.py -i "D:\fft out\start_dataset\rectification" -o "D:\fft out\start_dataset\disparity" -s 0.5
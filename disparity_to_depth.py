@@ -1,12 +1,19 @@
 import cv2
 import numpy as np
-from PIL import Image
-import matplotlib.pyplot as plt
 
 import argparse
 import os
+from functools import partial
 
-def compute_dept_from_disparity_and_projection(P1, P2, disparity_npy_path, output_depth_path=None, heatmap_file_path=None, colormap='inferno_r', vmin=0, vmax=3):
+from src.depth import depth_from_disparity, projection_depth_constants, q_depth_from_disparity, reproject_image_to_3d, save_depth_map, save_heatmap
+from src.instrumentation import add_instrumentation_arguments, enable_from_args, metrics
+from src.manifest import ChecksumWriter, Manifest, add_manifest_arguments
+from src.parallel import process_map
+from src.point_cloud import POINT_CLOUD_FORMATS, save_point_cloud
+from src.rectify import common_roi, cropped_q_matrix
+from src.stereo_map import load_stereo_map
+
+def compute_dept_from_disparity_and_projection(P1, P2, disparity_npy_path, output_depth_path=None, heatmap_file_path=None, colormap='inferno_r', vmin=0, vmax=3, out=None):
     """
     Compute the depth map from the disparity .npy file and save it to the specified output paths.
     
@@ -19,46 +26,33 @@ def compute_dept_from_disparity_and_projection(P1, P2, disparity_npy_path, outpu
     - colormap: The colormap to use for heatmap visualization (default: 'plasma').
     - vmin: Minimum value for heatmap scaling (default: 0).
     - vmax: Maximum value for heatmap scaling (default: 3).
+    - out: Preallocated float32 buffer for the depth map (default: None).
+
+    Returns:
+    - The depth map.
     """
     
-    # Load the disparity map from the .npy file
-    disparity_map = np.load(disparity_npy_path).astype(np.float32)
+    # Memory-map the disparity map from the .npy file, it is converted into the float32 depth buffer
+    disparity_map = np.load(disparity_npy_path, mmap_mode='r')
     
     if disparity_map is None:
         raise FileNotFoundError(f"Disparity .npy file not found at {disparity_npy_path}")
 
-    f_x = P1[0, 0]  # Focal length in x-direction
-    cx_left = P1[0, 2]  # Principal point x-coordinate of the left camera
-    cx_right = P2[0, 2]  # Principal point x-coordinate of the right camera
-    baseline = np.abs(P2[0, 3] / f_x) # Baseline between the two cameras
-
-    # Calculate depth:
-    adjusted_disparity = np.abs(disparity_map + (cx_right - cx_left))
-    epsilon = 1e-6  # Small constant to avoid division by zero
-    adjusted_disparity[adjusted_disparity == 0] = epsilon
-    depth_map = (f_x * baseline) / adjusted_disparity
+    focal_baseline, offset = projection_depth_constants(P1, P2)
+    depth_map = depth_from_disparity(disparity_map, focal_baseline, offset, out)
 
     # Save depth map as a floating-point image if output_depth_path is provided
     if output_depth_path is not None:
-        depth_pil_image = Image.fromarray(depth_map.astype(np.float32), mode='F')
-        depth_pil_image.save(output_depth_path)
-        #print(f'Saved depth map: {output_depth_path}')
+        save_depth_map(depth_map, output_depth_path)
 
     # Save heatmap visualization of the depth map if heatmap_file_path is provided
     if heatmap_file_path is not None:
-        plt.imshow(depth_map, cmap=colormap, vmin=vmin, vmax=vmax)
-        
-        # Remove axes
-        plt.axis('off')
-
-        # Save the heatmap without any additional space around the image
-        plt.savefig(heatmap_file_path, bbox_inches='tight', pad_inches=0)
-        plt.close()
+        save_heatmap(depth_map, heatmap_file_path, colormap, vmin, vmax)
 
-        #print(f'Saved heatmap: {heatmap_file_path}')
+    return depth_map
 
 
-def compute_depth_from_disparity_and_Q(disparity_npy_path, Q_matrix, output_depth_path=None, heatmap_file_path=None, colormap='inferno_r', vmin=0, vmax=3):
+def compute_depth_from_disparity_and_Q(disparity_npy_path, Q_matrix, output_depth_path=None, heatmap_file_path=None, colormap='inferno_r', vmin=0, vmax=3, out=None, xyz_output_path=None):
     """
     Compute the depth map from the disparity .npy file using the Q matrix and save it to the specified output paths.
     
@@ -70,94 +64,201 @@ def compute_depth_from_disparity_and_Q(disparity_npy_path, Q_matrix, output_dept
     - colormap: The colormap to use for heatmap visualization (default: 'plasma').
     - vmin: Minimum value for heatmap scaling (default: 0).
     - vmax: Maximum value for heatmap scaling (default: 3).
+    - out: Preallocated float32 buffer for the depth map (default: None).
+    - xyz_output_path: Path where the full X, Y, Z reprojection is saved as .npy (default: None).
+
+    Returns:
+    - The depth map.
     """
     
-    # Load the disparity map from the .npy file
-    disparity_map = np.load(disparity_npy_path).astype(np.float32)
+    # Memory-map the disparity map from the .npy file
+    disparity_map = np.load(disparity_npy_path, mmap_mode='r')
     
     if disparity_map is None:
         raise FileNotFoundError(f"Disparity .npy file not found at {disparity_npy_path}")
 
-    # Create a depth map
-    h, w = disparity_map.shape
-    disparity_map = disparity_map.reshape(-1, 1)
-    ones = np.ones((h * w, 1), dtype=np.float32)
-    
-    # Create a homogeneous disparity map (add the third dimension for disparity)
-    disparity_map_homogeneous = np.hstack((disparity_map, ones))
-    
-    # Compute 3D points using the Q matrix
-    points_3d_homogeneous = np.dot(Q_matrix, disparity_map_homogeneous.T).T
-    
-    # Convert back from homogeneous coordinates
-    points_3d = points_3d_homogeneous[:, :3] / points_3d_homogeneous[:, 3][:, np.newaxis]
-    
-    # Extract depth (Z coordinate)
-    depth_map = points_3d[:, 2].reshape(h, w)
+    # Only the Z row of the reprojection is evaluated, element-wise
+    depth_map = q_depth_from_disparity(disparity_map, Q_matrix, out)
     
     # Save depth map as a floating-point image if output_depth_path is provided
     if output_depth_path is not None:
-        depth_pil_image = Image.fromarray(depth_map.astype(np.float32), mode='F')
-        depth_pil_image.save(output_depth_path)
-        #print(f'Saved depth map: {output_depth_path}')
+        save_depth_map(depth_map, output_depth_path)
 
     # Save heatmap visualization of the depth map if heatmap_file_path is provided
     if heatmap_file_path is not None:
-        plt.imshow(depth_map, cmap=colormap, vmin=vmin, vmax=vmax)
-        
-        # Remove axes
-        plt.axis('off')
+        save_heatmap(depth_map, heatmap_file_path, colormap, vmin, vmax)
+
+    # Save the full reprojection if xyz_output_path is provided
+    if xyz_output_path is not None:
+        np.save(xyz_output_path, reproject_image_to_3d(disparity_map, Q_matrix))
+
+    return depth_map
+
+
+# Per-process float32 depth buffers, reused for all maps of the same size
+_depth_buffers = {}
 
-        # Save the heatmap without any additional space around the image
-        plt.savefig(heatmap_file_path, bbox_inches='tight', pad_inches=0)
-        plt.close()
+def _depth_buffer(shape):
+    if shape not in _depth_buffers:
+        _depth_buffers[shape] = np.empty(shape, dtype=np.float32)
+    return _depth_buffers[shape]
 
-        #print(f'Saved heatmap: {heatmap_file_path}')
+def _convert_job(job, focal_baseline, offset, Q, use_q, cloud_options=None, checksums=False, collect_metrics=False):
+    source, index, output_depth_path, heatmap_file_path, xyz_output_path, cloud_path, color_path = job
 
+    # Worker processes collect their own timings, they are merged by the main process
+    if collect_metrics:
+        metrics.enable_worker("disparity_to_depth worker")
+
+    # Maps are read through a memory map, either a single .npy file or one slice of a stack
+    disparity_map = np.load(source, mmap_mode='r')
+    if disparity_map.ndim == 3:
+        disparity_map = disparity_map[index]
+
+    with metrics.stage("depth"):
+        if use_q:
+            depth_map = q_depth_from_disparity(disparity_map, Q, _depth_buffer(disparity_map.shape))
+        else:
+            depth_map = depth_from_disparity(disparity_map, focal_baseline, offset, _depth_buffer(disparity_map.shape))
+
+    # CRC32 of the outputs, computed from the written bytes (in the order of the job outputs)
+    written = {}
+
+    if xyz_output_path is not None:
+        with metrics.stage("xyz"), open(xyz_output_path, 'wb') as file:
+            writer = ChecksumWriter(file) if checksums else file
+            np.save(writer, reproject_image_to_3d(disparity_map, Q, _depth_buffer(disparity_map.shape + (3,))))
+        written[xyz_output_path] = writer.checksum if checksums else None
+
+    if cloud_path is not None:
+        colors = None
+        if color_path is not None:
+            colors = cv2.imread(color_path)
+            if colors is None:
+                print(f"[WARNING]\tCould not read colour image {color_path}, saving the point cloud without colour.")
+        # The Q depth is reused for masking, otherwise it is computed from the disparities
+        with metrics.stage("point_cloud"):
+            saved = save_point_cloud(cloud_path, disparity_map, Q, colors, depth=depth_map if use_q else None,
+                                     checksum=checksums, **(cloud_options or {}))
+        written[cloud_path] = saved[1] if checksums else None
+
+    if output_depth_path is not None:
+        with metrics.stage("depth_write"):
+            written[output_depth_path] = save_depth_map(depth_map, output_depth_path, checksums)
+    if heatmap_file_path is not None:
+        with metrics.stage("heatmap"):
+            written[heatmap_file_path] = save_heatmap(depth_map, heatmap_file_path, checksum=checksums)
+
+    # Checksums and timings of this job, merged by the main process
+    outputs = [output_depth_path, heatmap_file_path, xyz_output_path, cloud_path]
+    return index, [written[path] for path in outputs if path is not None] if checksums else None, metrics.drain()
+
+def convert_batch(jobs, P1, P2, Q=None, use_q=False, workers=None, cloud_options=None, checksums=False):
+    """
+    Convert a batch of disparity maps to depth on a pool of worker processes.
+
+    Args:
+    - jobs: Iterable of (disparity .npy path, index, output depth path, heatmap path, xyz path,
+      point cloud path, colour image path) tuples. If the .npy file holds a stack of maps
+      (N x H x W), index selects the map. Outputs set to None are skipped.
+    - P1, P2: Projection matrices of the left and right camera.
+    - Q: 4x4 Q matrix, used instead of the projection matrices if use_q is set and for the xyz
+      and point cloud outputs.
+    - use_q: Use the Q matrix method (default: False).
+    - workers: Number of worker processes (default: number of CPUs).
+    - cloud_options: Keyword arguments for save_point_cloud, e.g. min_disparity, max_depth (default: None).
+    - checksums: Compute the CRC32 of the written files (default: False).
+
+    Returns:
+    - Generator of (index, CRC32 of the depth, heatmap, xyz and point cloud outputs that were
+      written, or None without checksums) of the converted maps, in input order.
+    """
+    # Constants are derived once for the whole batch
+    focal_baseline, offset = projection_depth_constants(P1, P2)
+    convert = partial(_convert_job, focal_baseline=focal_baseline, offset=offset, Q=Q, use_q=use_q, cloud_options=cloud_options,
+                      checksums=checksums, collect_metrics=metrics.enabled)
+    for index, written, timings in process_map(convert, jobs, workers):
+        metrics.merge(timings)
+        yield index, written
+
+def list_jobs(input_path, output_folder, xyz=False, heatmap=True, point_cloud=None, color_folder=None, start=0, stop=None):
+    def job(source, counter):
+        heatmap_file_path = f"{output_folder}/{counter}_heatmap.png" if heatmap else None
+        xyz_output_path = f"{output_folder}/{counter}_xyz.npy" if xyz else None
+        cloud_path = f"{output_folder}/{counter}_points.{point_cloud}" if point_cloud else None
+        color_path = f"{color_folder}/rectified_left_image_{counter}.jpg" if point_cloud and color_folder else None
+        return source, counter, f"{output_folder}/{counter}_depth.tif", heatmap_file_path, xyz_output_path, cloud_path, color_path
+
+    # A single .npy stack of disparity maps, or a folder of rectified_left_<N>.npy files
+    if os.path.isfile(input_path):
+        num_maps = np.load(input_path, mmap_mode='r').shape[0]
+        for counter in range(start, num_maps if stop is None else min(stop, num_maps)):
+            yield job(input_path, counter)
+        return
+
+    counter = start
+    while stop is None or counter < stop:
+        npy_path = f"{input_path}/rectified_left_{counter}.npy"
+        if not os.path.exists(npy_path):
+            break
+        yield job(npy_path, counter)
+        counter += 1
 
 def main(args):
     # Load calibration data
-    cv_file_path = f"data/out/stereo_map_{args.name}.xml"
-    if not os.path.exists(cv_file_path):
-        raise FileNotFoundError(f"Calibration file not found: {cv_file_path}")
-    
-    cv_file = cv2.FileStorage(cv_file_path, cv2.FILE_STORAGE_READ)
-    
-    P1 = cv_file.getNode('P_l').mat()
-    P2 = cv_file.getNode('P_r').mat()
-    Q = cv_file.getNode('Q').mat()
+    calibration = load_stereo_map(args.name, ['P_l', 'P_r', 'Q', 'roi_l', 'roi_r'])
     
-    cv_file.release()
+    P1 = np.array(calibration['P_l'])
+    P2 = np.array(calibration['P_r'])
+
+    # Disparities of cropped rectified images have their origin at the crop corner
+    roi = common_roi(calibration['roi_l'], calibration['roi_r']) if args.crop else None
+    Q = cropped_q_matrix(calibration['Q'], roi)
+    if roi is not None:
+        print(f"[INFO]\tDisparity maps cropped to x={roi[0]}, y={roi[1]}, {roi[2]}x{roi[3]} px.")
     
-    input_folder = args.input
     output_folder = args.output
     os.makedirs(output_folder, exist_ok=True)
 
-    counter = 0
-
-    print("[INFO]\tComputing depth images from disparity maps...")
+    cloud_options = {
+        'min_disparity': args.min_disparity,
+        'max_disparity': args.max_disparity,
+        'max_depth': args.max_depth,
+    }
+    start, stop = args.range or (0, None)
+    jobs = list_jobs(args.input, output_folder, args.xyz, not args.no_heatmap, args.point_cloud, args.color, start, stop)
 
-    while True:
+    # Completed maps are recorded in the manifest, so an interrupted run can be resumed
+    settings = (f"calibration={args.name};use_q={args.use_q};crop={args.crop};min_disparity={args.min_disparity};"
+                f"max_disparity={args.max_disparity};max_depth={args.max_depth};color={args.color}")
+    manifest = Manifest(f"{output_folder}/manifest.jsonl", args.resume, args.checksums, args.fresh, settings)
+    outputs = {}
 
-        if counter % 10 == 0:
-            print(f"      \t... Processed {counter} maps...", end="\r")
+    def job_outputs(job):
+        return [path for path in job[2:6] if path is not None]
 
-        npy_path = f"{input_folder}/rectified_left_{counter}.npy"
+    def pending_jobs():
+        for job in manifest.pending(jobs, key=lambda job: job[1], outputs=job_outputs):
+            outputs[job[1]] = job_outputs(job)
+            yield job
 
-        if not os.path.exists(npy_path):
-            print(f"No more files found. Exiting loop.")
-            break
+    counter = 0
 
-        output_depth_path = f"{output_folder}/{counter}_depth.tif"
-        heatmap_file_path = f"{output_folder}/{counter}_heatmap.png"
+    print("[INFO]\tComputing depth images from disparity maps...")
 
-        if args.use_q:
-            compute_depth_from_disparity_and_Q(Q, npy_path, output_depth_path, heatmap_file_path)
-        else:
-            compute_dept_from_disparity_and_projection(P1, P2, npy_path, output_depth_path, heatmap_file_path)
+    try:
+        for index, written in convert_batch(pending_jobs(), P1, P2, Q, args.use_q, args.workers, cloud_options, args.checksums):
+            manifest.record(index, outputs.pop(index), written)
+            counter += 1
+            metrics.progress()
+            if counter % 10 == 0:
+                print(f"      \t... Processed {counter} maps...", end="\r")
+    finally:
+        manifest.close()
 
-        counter += 1
     print("                                                                                    ", end="\r")
+    if manifest.skipped:
+        print(f"[INFO]\tSkipped {manifest.skipped} maps completed by an earlier run.")
     print(f"[INFO]\t... Conversion of {counter} disparity maps complete!")
 
 if __name__ == '__main__':
@@ -165,9 +266,22 @@ if __name__ == '__main__':
     
     parser.add_argument('-q', '--use_q', action='store_true', help='Use Q matrix method (default: projection matrices)')
     parser.add_argument('-n', '--name', required=True, help='Name of the calibration file (located in data/out/stereo_map_<name>.xml)')
-    parser.add_argument('-i', '--input', required=True, help='Folder containing the disparity .npy files')
+    parser.add_argument('-i', '--input', required=True, help='Folder containing the disparity .npy files, or a single .npy file with a stack of disparity maps')
     parser.add_argument('-o', '--output', required=True, help='Folder to save the depth results to')
+    parser.add_argument('--no-heatmap', action='store_true', help='Do not save the <N>_heatmap.png visualizations')
+    parser.add_argument('-x', '--xyz', action='store_true', help='Also save the full X, Y, Z reprojection (Q matrix) as <N>_xyz.npy')
+    parser.add_argument('-p', '--point-cloud', choices=POINT_CLOUD_FORMATS, help='Also save the valid 3D points (Q matrix) as <N>_points.ply (binary) or <N>_points.npy')
+    parser.add_argument('--color', help='Folder with the rectified left images (rectified_left_image_<N>.jpg) to colour the point clouds')
+    parser.add_argument('--min-disparity', type=float, default=0, help='Point clouds: drop disparities at or below this value (default: 0)')
+    parser.add_argument('--max-disparity', type=float, help='Point clouds: drop disparities above this value (default: no limit)')
+    parser.add_argument('--max-depth', type=float, help='Point clouds: drop points farther away than this depth (default: no limit)')
+    parser.add_argument('-c', '--crop', action='store_true', help='The disparity maps were computed from cropped rectified images (rectification.py -c), shifts the Q matrix origin accordingly')
+    parser.add_argument('-w', '--workers', type=int, help='Number of worker processes (default: number of CPUs)')
+    add_manifest_arguments(parser)
+    add_instrumentation_arguments(parser)
     
     args = parser.parse_args()
-    
-    main(args)
\ No newline at end of file
+
+    enable_from_args("disparity_to_depth", args)
+    main(args)
+    metrics.close()
@@ -0,0 +1,251 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from disparity_to_depth import compute_dept_from_disparity_and_projection, compute_depth_from_disparity_and_Q
+from src.calibrate_camera import calibrate_camera
+from src.chessboard_detection import detect_corners
+from src.colormap import colorize, colormap_lut
+from src.depth import save_depth_map
+from src.image_writer import write_image
+from src.rectify import INTERPOLATIONS, StereoRectifier
+from src.stereo_calibration import stereo_calibrate
+
+STAGES = ['detection', 'solve', 'stereo', 'remap', 'io', 'depth', 'heatmap']
+
+def camera_matrix(image_size):
+    # Ground truth intrinsics, a moderately wide lens with centered principal point
+    width, height = image_size
+    focal = 0.9 * width
+    return np.array([[focal, 0, (width - 1) / 2], [0, focal, (height - 1) / 2], [0, 0, 1]])
+
+def board_texture(pattern_size, pixels_per_square=40):
+    # Chessboard with one white square of margin, inner corners at multiples of a square
+    cols, rows = pattern_size[0] + 1, pattern_size[1] + 1
+    squares = (np.add.outer(np.arange(rows), np.arange(cols)) % 2 == 0).astype(np.uint8) * 255
+    board = cv2.resize(squares, (cols * pixels_per_square, rows * pixels_per_square), interpolation=cv2.INTER_NEAREST)
+    return cv2.copyMakeBorder(board, pixels_per_square, pixels_per_square, pixels_per_square, pixels_per_square,
+                              cv2.BORDER_CONSTANT, value=255)
+
+def render_view(texture, K, R, t, square_size, image_size, pixels_per_square=40):
+    """
+    Render the board texture as seen by a pinhole camera.
+
+    The board lies in the z = 0 plane of its coordinate system with the first inner corner at
+    the origin, like the object points used by calibrate_camera.
+    """
+    # Texture pixel -> board coordinates: the first inner corner is two squares from the texture corner
+    to_board = np.array([[square_size / pixels_per_square, 0, -2 * square_size],
+                         [0, square_size / pixels_per_square, -2 * square_size],
+                         [0, 0, 1]])
+    homography = K @ np.column_stack([R[:, 0], R[:, 1], t]) @ to_board
+    image = cv2.warpPerspective(texture, homography, image_size, flags=cv2.INTER_AREA, borderValue=128)
+    return cv2.GaussianBlur(image, (3, 3), 0.7)
+
+def random_poses(rng, num_views, pattern_size, square_size, K, image_size):
+    # Boards filling about half of the image width, tilted up to 30 degrees and moved around the center
+    board_width = (pattern_size[0] + 1) * square_size
+    distance = K[0, 0] * board_width / (0.45 * image_size[0])
+    poses = []
+    for _ in range(num_views):
+        rvec = np.deg2rad(rng.uniform(-30, 30, 3)) * [1, 1, 0.3]
+        R, _ = cv2.Rodrigues(rvec)
+        center = np.array([(pattern_size[0] - 1) * square_size / 2, (pattern_size[1] - 1) * square_size / 2, 0])
+        target = np.array([rng.uniform(-0.15, 0.15) * board_width, rng.uniform(-0.1, 0.1) * board_width,
+                           distance * rng.uniform(0.9, 1.2)])
+        poses.append((R, target - R @ center))
+    return poses
+
+def synthesize_views(image_size, num_views, pattern_size, square_size, baseline, seed):
+    """
+    Render stereo views of a chessboard from known intrinsics and extrinsics.
+
+    Returns:
+    - Left images, right images, camera matrix, rotation and translation of the right camera.
+    """
+    rng = np.random.default_rng(seed)
+    K = camera_matrix(image_size)
+    R_stereo, _ = cv2.Rodrigues(np.deg2rad([0.5, -1.0, 0.2]))
+    T_stereo = np.array([-baseline, 0, 0])
+
+    texture = board_texture(pattern_size)
+    images_l, images_r = [], []
+    for R, t in random_poses(rng, num_views, pattern_size, square_size, K, image_size):
+        images_l.append(render_view(texture, K, R, t, square_size, image_size))
+        images_r.append(render_view(texture, K, R_stereo @ R, R_stereo @ t + T_stereo, square_size, image_size))
+    return images_l, images_r, K, R_stereo, T_stereo.reshape(3, 1)
+
+def random_disparities(rng, image_size, num_maps, max_disparity=128):
+    # Smooth random surfaces with a few invalid pixels, as float32 like the matcher output
+    width, height = image_size
+    maps = []
+    for _ in range(num_maps):
+        coarse = rng.uniform(8, max_disparity, (height // 32 + 2, width // 32 + 2)).astype(np.float32)
+        disparity = cv2.resize(coarse, image_size, interpolation=cv2.INTER_CUBIC)
+        disparity[rng.random((height, width)) < 0.02] = np.nan
+        maps.append(disparity)
+    return maps
+
+def measure(function, *args, **kwargs):
+    # Wall time and peak of the memory allocated through Python and NumPy while running
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    return result, elapsed, peak
+
+def report(resolution, stage, frames, elapsed, peak, note=""):
+    fps = frames / elapsed if elapsed > 0 else float('inf')
+    print(f"      \t{resolution:<10} {stage:<18} {frames:6d} {fps:9.1f} {elapsed / max(frames, 1) * 1000:9.1f} {peak / 2 ** 20:9.1f}  {note}")
+
+def run_calibration_stages(resolution, image_size, args, stages):
+    images_l, images_r, K_true, R_true, T_true = synthesize_views(image_size, args.views, args.pattern, args.square_size,
+                                                                  args.baseline, args.seed)
+    corners_l = corners_r = None
+    if stages & {'detection', 'solve', 'stereo'}:
+        corners_l, elapsed, peak = measure(detect_corners, images_l, args.pattern, workers=args.workers)
+        corners_r = detect_corners(images_r, args.pattern, workers=args.workers)
+        if 'detection' in stages:
+            report(resolution, "detection", len(images_l), elapsed, peak, f"{corners_l.num_detected()}/{len(images_l)} boards found")
+
+    mtx = dist = None
+    if stages & {'solve', 'stereo'}:
+        with contextlib.redirect_stdout(io.StringIO()):
+            (rmse, mtx, dist), elapsed, peak = measure(calibrate_camera, None, args.pattern, args.square_size,
+                                                       visualize=False, corner_set=corners_l)
+        if 'solve' in stages:
+            if mtx is None:
+                report(resolution, "solve", len(images_l), elapsed, peak, "calibration failed")
+            else:
+                focal_error = abs(mtx[0, 0] - K_true[0, 0]) / K_true[0, 0] * 100
+                report(resolution, "solve", len(images_l), elapsed, peak, f"rmse {rmse:.3f} px, focal error {focal_error:.2f}%")
+
+    if 'stereo' in stages and mtx is not None:
+        with contextlib.redirect_stdout(io.StringIO()):
+            (R, T), elapsed, peak = measure(stereo_calibrate, mtx, dist, mtx, dist, None, None, args.pattern, args.square_size,
+                                            visualize=False, corner_set_l=corners_l, corner_set_r=corners_r)
+        baseline_error = abs(np.linalg.norm(T) - np.linalg.norm(T_true)) / np.linalg.norm(T_true) * 100
+        report(resolution, "stereo", len(images_l), elapsed, peak, f"baseline error {baseline_error:.2f}%")
+
+    return images_l, images_r, R_true, T_true
+
+def run_benchmark(args):
+    stages = set(args.stages)
+    tracemalloc.start()
+
+    print(f"[INFO]\tSynthetic benchmark: {args.views} views and {args.maps} disparity maps per resolution (seed {args.seed}).")
+    # Peak memory is what Python and NumPy allocated during the stage, OpenCV's internal buffers are not traced
+    print("      \tresolution stage              frames  frames/s  ms/frame  peak [MB]")
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        for image_size in args.resolutions:
+            resolution = f"{image_size[0]}x{image_size[1]}"
+            K_true = camera_matrix(image_size)
+            images_l, images_r, R_true, T_true = run_calibration_stages(resolution, image_size, args, stages)
+
+            # Rectification maps from the ground truth calibration
+            zero_dist = np.zeros(5)
+            R_l, R_r, P_l, P_r, Q, roi_l, roi_r = cv2.stereoRectify(K_true, zero_dist, K_true, zero_dist, image_size, R_true, T_true, alpha=0)
+            map_l = cv2.initUndistortRectifyMap(K_true, zero_dist, R_l, P_l, image_size, cv2.CV_16SC2)
+            map_r = cv2.initUndistortRectifyMap(K_true, zero_dist, R_r, P_r, image_size, cv2.CV_16SC2)
+            stereo_map = {'stereo_map_l_x': map_l[0], 'stereo_map_l_y': map_l[1], 'stereo_map_r_x': map_r[0],
+                          'stereo_map_r_y': map_r[1], 'roi_l': roi_l, 'roi_r': roi_r}
+            pairs = [(cv2.cvtColor(l, cv2.COLOR_GRAY2BGR), cv2.cvtColor(r, cv2.COLOR_GRAY2BGR)) for l, r in zip(images_l, images_r)]
+
+            rectified = pairs
+            if 'remap' in stages:
+                for interpolation in INTERPOLATIONS:
+                    rectifier = StereoRectifier(stereo_map, interpolation)
+                    rectified, elapsed, peak = measure(lambda: [rectifier.rectify(l, r) for l, r in pairs])
+                    report(resolution, f"remap {interpolation}", len(pairs), elapsed, peak)
+
+            if 'io' in stages:
+                def write_pairs():
+                    for counter, (rect_img_l, rect_img_r) in enumerate(rectified):
+                        write_image(f"{temp_folder}/left_{counter}.jpg", rect_img_l)
+                        write_image(f"{temp_folder}/right_{counter}.jpg", rect_img_r)
+
+                def read_pairs():
+                    for counter in range(len(rectified)):
+                        cv2.imread(f"{temp_folder}/left_{counter}.jpg")
+                        cv2.imread(f"{temp_folder}/right_{counter}.jpg")
+
+                _, elapsed, peak = measure(write_pairs)
+                report(resolution, "io jpg write", len(rectified), elapsed, peak)
+                _, elapsed, peak = measure(read_pairs)
+                report(resolution, "io jpg read", len(rectified), elapsed, peak)
+
+            if stages & {'depth', 'heatmap'}:
+                rng = np.random.default_rng(args.seed)
+                disparity_paths = []
+                for counter, disparity in enumerate(random_disparities(rng, image_size, args.maps)):
+                    disparity_paths.append(f"{temp_folder}/rectified_left_{counter}.npy")
+                    np.save(disparity_paths[-1], disparity)
+                out = np.empty((image_size[1], image_size[0]), dtype=np.float32)
+
+                depth_maps, elapsed, peak = measure(lambda: [compute_dept_from_disparity_and_projection(P_l, P_r, path, out=out).copy()
+                                                             for path in disparity_paths])
+                if 'depth' in stages:
+                    report(resolution, "depth projection", len(disparity_paths), elapsed, peak)
+                    _, elapsed, peak = measure(lambda: [compute_depth_from_disparity_and_Q(path, Q, out=out) for path in disparity_paths])
+                    report(resolution, "depth Q", len(disparity_paths), elapsed, peak)
+                    _, elapsed, peak = measure(lambda: [save_depth_map(depth_map, f"{temp_folder}/{counter}_depth.tif")
+                                                        for counter, depth_map in enumerate(depth_maps)])
+                    report(resolution, "io depth tif", len(depth_maps), elapsed, peak)
+
+                if 'heatmap' in stages:
+                    # The lookup table is built once per process, not part of the per-frame cost
+                    colormap_lut()
+                    _, elapsed, peak = measure(lambda: [colorize(depth_map) for depth_map in depth_maps])
+                    report(resolution, "heatmap colorize", len(depth_maps), elapsed, peak)
+                    _, elapsed, peak = measure(lambda: [cv2.imwrite(f"{temp_folder}/{counter}_heatmap.png", colorize(depth_map))
+                                                        for counter, depth_map in enumerate(depth_maps)])
+                    report(resolution, "heatmap png", len(depth_maps), elapsed, peak)
+
+    tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS, includes OpenCV's own buffers
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        max_rss_mb = max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+        print(f"[INFO]\tPeak resident memory of the process: {max_rss_mb:.0f} MB")
+    except ImportError:
+        pass
+
+def parse_resolution(value):
+    try:
+        width, height = (int(v) for v in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value}")
+    return width, height
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the calibration, rectification and depth stages on synthetic data.")
+    parser.add_argument('-r', '--resolutions', type=parse_resolution, nargs='+', default=[(640, 480), (1280, 720), (1920, 1080)],
+                        help="Image resolutions to benchmark, as WIDTHxHEIGHT (default: 640x480 1280x720 1920x1080).")
+    parser.add_argument('-v', '--views', type=int, default=15, help="Number of rendered stereo chessboard views per resolution (default: 15).")
+    parser.add_argument('-m', '--maps', type=int, default=10, help="Number of random disparity maps per resolution (default: 10).")
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES, default=STAGES, help="Stages to benchmark (default: all).")
+    parser.add_argument('-p', '--pattern', type=parse_resolution, default=(7, 4), help="Inner corners of the chessboard, as COLSxROWS (default: 7x4).")
+    parser.add_argument('--square-size', type=float, default=0.0311, help="Size of a chessboard square in meters (default: 0.0311).")
+    parser.add_argument('--baseline', type=float, default=0.06, help="Distance between the cameras in meters (default: 0.06).")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="Number of processes for the corner detection (default: 1).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data (default: 0).")
+    args = parser.parse_args()
+
+    run_benchmark(args)
+
+# Example Usage:
+# python helper_scripts/benchmark.py -r 1280x720 -s detection solve remap
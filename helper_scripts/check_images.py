@@ -1,26 +1,179 @@
 import os
+import sys
+import json
+from functools import partial
 from PIL import Image
-import numpy as np
 import argparse
 
-def check_images_in_folder(folder_path):
-    faulty_images = []
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.instrumentation import add_instrumentation_arguments, enable_from_args, metrics
+from src.parallel import process_map
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')
+
+# Formats whose truncation is found without decoding, all others are always fully decoded
+FAST_CHECK_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+# Files are checked in chunks, submitting a million single files to the pool costs more than checking them
+CHUNK_SIZE = 64
 
+def list_image_files(folder_path):
     # Walk through the directory to find images
     for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')):
-                file_path = os.path.join(root, file)
-                try:
-                    # Try to open the image and convert it to a NumPy array
-                    img = Image.open(file_path)
-                    img = img.convert('RGB')  # Convert to RGB to ensure consistency
-                    np.array(img).astype(np.uint8)  # Attempt conversion to NumPy array
-                    print(f"{file}: OK")
-                except Exception as e:
-                    # If any exception occurs, log the file as faulty
-                    print(f"{file}: Faulty ({str(e)})")
-                    faulty_images.append(file_path)
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, file)
+
+def _trailer_problem(file_path, extension, size):
+    # Truncated files lack the end marker of their format
+    with open(file_path, 'rb') as file:
+        head = file.read(8)
+        file.seek(max(size - 64, 0))
+        tail = file.read().rstrip(b'\x00')
+
+    if extension in ('.jpg', '.jpeg'):
+        if not head.startswith(b'\xff\xd8'):
+            return "missing JPEG start marker"
+        if not tail.endswith(b'\xff\xd9'):
+            return "missing JPEG end marker"
+    elif extension == '.png':
+        if not head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return "missing PNG signature"
+        if not tail.endswith(b'IEND\xaeB`\x82'):
+            return "missing PNG end chunk"
+    elif extension == '.gif':
+        if not head.startswith(b'GIF8'):
+            return "missing GIF signature"
+        if not tail.endswith(b';'):
+            return "missing GIF trailer"
+    elif extension == '.bmp':
+        # BMP has no end marker, but its header gives the file size (0 is allowed, then decode)
+        if not head.startswith(b'BM'):
+            return "missing BMP signature"
+        header_size = int.from_bytes(head[2:6], 'little')
+        if header_size == 0:
+            return "no file size in BMP header"
+        if size < header_size:
+            return f"file has {size} of {header_size} bytes"
+    return None
+
+def _decode(file_path):
+    # Full decode of all pixels, raises on truncated or corrupt data
+    with Image.open(file_path) as img:
+        img.load()
+
+def check_image(file_path, full=False):
+    """
+    Check a single image file.
+
+    The fast check reads the file header and trailer and runs PIL's verify(), which parses the
+    structure without decoding the pixels. Only files that look suspicious there are fully
+    decoded; a file with e.g. junk after its end marker that still decodes is reported as OK.
+    verify() does not notice truncated pixel data, so only the formats in FAST_CHECK_EXTENSIONS,
+    whose header or trailer reveals a truncation, use the fast check. All other formats (e.g.
+    TIFF) are always fully decoded.
+
+    Args:
+    - file_path: Path of the image.
+    - full: Always decode all pixels (default: False).
+
+    Returns:
+    - None if the image is OK, otherwise the reason why it is faulty.
+    """
+    try:
+        size = os.path.getsize(file_path)
+        if size == 0:
+            return "empty file"
+
+        extension = os.path.splitext(file_path)[1].lower()
+        if full or extension not in FAST_CHECK_EXTENSIONS:
+            _decode(file_path)
+            return None
+
+        suspicion = _trailer_problem(file_path, extension, size)
+        if suspicion is None:
+            with Image.open(file_path) as img:
+                img.verify()
+            return None
+    except Exception as e:
+        suspicion = str(e)
+
+    # Confirm the suspicion by decoding the image
+    try:
+        _decode(file_path)
+    except Exception as e:
+        return f"{suspicion}: {e}" if suspicion != str(e) else suspicion
+    return None
+
+def _check_chunk(chunk, full=False, collect_metrics=False):
+    if collect_metrics:
+        metrics.enable_worker("check_images worker")
+
+    results = []
+    for file_path in chunk:
+        with metrics.stage("check"):
+            results.append((file_path, check_image(file_path, full)))
+    # Timings of this chunk, merged by the main process
+    return results, metrics.drain()
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def check_images_in_folder(folder_path, workers=None, full=False, report_path=None, verbose=False):
+    """
+    Check all images below a folder on a pool of worker processes.
+
+    Args:
+    - folder_path: Folder searched recursively.
+    - workers: Number of worker processes (default: number of CPUs).
+    - full: Fully decode every image instead of the fast header and trailer check (default: False).
+    - report_path: Write one JSON line per faulty image ({"path": ..., "error": ...}) (default: None).
+    - verbose: Print a line for every image, not only for the faulty ones (default: False).
+
+    Returns:
+    - List of the faulty image paths.
+    """
+    faulty_images = []
+    checked = 0
+    report = open(report_path, 'w') if report_path is not None else None
+
+    try:
+        check = partial(_check_chunk, full=full, collect_metrics=metrics.enabled)
+        for results, timings in process_map(check, _chunks(list_image_files(folder_path), CHUNK_SIZE), workers):
+            metrics.merge(timings)
+            metrics.progress(len(results))
+            for file_path, error in results:
+                checked += 1
+                if error is None:
+                    if verbose:
+                        print(f"{os.path.basename(file_path)}: OK")
+                    continue
+
+                # If any check fails, log the file as faulty
+                print(f"{os.path.basename(file_path)}: Faulty ({error})")
+                faulty_images.append(file_path)
+                metrics.count("faulty")
+                if report is not None:
+                    report.write(json.dumps({'path': file_path, 'error': error}) + "\n")
+                    report.flush()
+
+            if not verbose and checked % (100 * CHUNK_SIZE) < CHUNK_SIZE:
+                print(f"      \t... Checked {checked} images...", end="\r")
+    finally:
+        if report is not None:
+            report.close()
+
+    print("                                                                                    ", end="\r")
+    print(f"Checked {checked} images.")
+    metrics.count("images", checked)
 
     # Output the list of faulty images
     if faulty_images:
@@ -29,14 +182,23 @@ def check_images_in_folder(folder_path):
             print(img)
     else:
         print("No faulty images found.")
+    return faulty_images
 
 if __name__ == "__main__":
     # Create an argument parser
     parser = argparse.ArgumentParser(description="Check for faulty images in a folder.")
     parser.add_argument("-i", "--input", type=str, required=True, help="Path to the input folder containing images.")
-    
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument("-f", "--full", action="store_true", help="Fully decode every image instead of checking headers and end markers first.")
+    parser.add_argument("-o", "--output", type=str, help="Write the faulty images as JSON lines (path and error) to this file.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print a line for every image, not only for faulty ones.")
+    add_instrumentation_arguments(parser)
+
     # Parse the arguments
     args = parser.parse_args()
-    
+
+    enable_from_args("check_images", args)
+
     # Check images in the specified folder
-    check_images_in_folder(args.input)
+    check_images_in_folder(args.input, args.workers, args.full, args.output, args.verbose)
+    metrics.close()
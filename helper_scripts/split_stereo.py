@@ -1,18 +1,47 @@
 import cv2
 import os
+import sys
 import argparse
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.chessboard_detection import find_chessboard
+from src.image_writer import write_image
+from src.parallel import resolve_workers
+from src.pipeline import Pipeline
+
 pattern_size = (4,7) # Chessboard size
 
-def filter_detectable(image):
-    # Convert the image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    # Try to find the chessboard corners
-    ret, _ = cv2.findChessboardCorners(gray, pattern_size, flags=cv2.CALIB_CB_FAST_CHECK)
+def filter_detectable(image, max_dim=None):
+    # Try to find the chessboard corners, optionally on a downscaled copy of the image
+    ret, _ = find_chessboard(image, pattern_size, max_dim, flags=cv2.CALIB_CB_FAST_CHECK)
     
     return ret  # Returns True if a chessboard is detected, False otherwise
 
-def split_video_frames(video_path, start_frame, apply_filter=False):
+def read_frames(cap, start_frame=0, stride=1):
+    # Runs in the decode thread of the pipeline, yields (frame number, frame)
+    frame_count = 0
+    if start_frame > 0:
+        # Seek instead of decoding all frames before the start frame
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_count = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+        if frame_count != start_frame:
+            # Seeking not supported by the backend, skip the frames without converting them
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            frame_count = 0
+            while frame_count < start_frame and cap.grab():
+                frame_count += 1
+
+    while True:
+        if (frame_count - start_frame) % stride == 0:
+            ret, frame = cap.read()
+            if not ret:
+                break  # End of video
+            yield frame_count, frame
+        elif not cap.grab():
+            break
+        frame_count += 1
+
+def split_video_frames(video_path, start_frame, apply_filter=False, max_dim=None, stride=1, workers=None):
     # Create directories if they do not exist
     directory_path = os.path.dirname(video_path)
     left_folder = os.path.join(directory_path, "left_images")
@@ -20,52 +49,55 @@ def split_video_frames(video_path, start_frame, apply_filter=False):
     os.makedirs(left_folder, exist_ok=True)
     os.makedirs(right_folder, exist_ok=True)
 
+    workers = resolve_workers(workers)
+
     # Capture the video
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         print(f"[ERROR]\tCannot open video file: {video_path}")
         return
 
-    frame_count = 0
-    saved_count = 0
-    while True:
+    def filter_frame(item):
+        frame_count, frame = item
+        if not filter_detectable(frame, max_dim):
+            print(f"[INFO]\tFrame {frame_count} not detectable!")
+            return None
+        return item
 
-        ret, frame = cap.read()
+    def save_frame(item):
+        frame_count, frame = item
 
-        if not ret:
-            break  # End of video
-        
-        if frame_count >= start_frame: 
-
-            if apply_filter and not filter_detectable(frame):
-                print(f"[INFO]\tFrame {frame_count} not detectable!")
-                frame_count += 1
-                continue
+        # Split the frame in the middle into left and right images
+        mid_index = frame.shape[1] // 2
+        left_image = frame[:, :mid_index]
+        right_image = frame[:, mid_index:]
 
-            # Get the dimensions of the frame
-            _, width, _ = frame.shape
+        # Save the left and right images
+        left_image_path = os.path.join(left_folder, f"left_image_{frame_count}.jpg")
+        right_image_path = os.path.join(right_folder, f"right_image_{frame_count}.jpg")
 
-            # Calculate the middle index to split the frame
-            mid_index = width // 2
+        if not write_image(left_image_path, left_image) or not write_image(right_image_path, right_image):
+            print(f"[ERROR]\tFailed to save frame {frame_count:04d}")
+            return None
 
-            # Split the frame into left and right images
-            left_image = frame[:, :mid_index]
-            right_image = frame[:, mid_index:]
+        print(f"[INFO]\tSaved frame {frame_count:04d} left and right images")
+        return frame_count
 
-            # Save the left and right images
-            left_image_path = os.path.join(left_folder, f"left_image_{frame_count}.jpg")
-            right_image_path = os.path.join(right_folder, f"right_image_{frame_count}.jpg")
-            
-            cv2.imwrite(left_image_path, left_image)
-            cv2.imwrite(right_image_path, right_image)
+    # Decoding runs in the feeder thread, detection and JPEG encoding in thread pools
+    pipeline = Pipeline(queue_size=2 * workers)
+    if apply_filter:
+        pipeline.add_stage("filter", filter_frame, workers)
+    pipeline.add_stage("encode", save_frame, workers)
 
-            print(f"[INFO]\tSaved frame {frame_count:04d} left and right images")
+    saved_count = 0
+    try:
+        for _ in pipeline.run(read_frames(cap, start_frame, stride)):
             saved_count += 1
+    finally:
+        cap.release()
 
-        frame_count += 1
-
-    cap.release()
     print(f"[INFO]\tVideo processing completed, saved {saved_count} images.")
+    pipeline.print_stats()
 
 def main():
 
@@ -74,6 +106,9 @@ def main():
     parser.add_argument('-i', '--input', type=str, required=True, help='Set input video path')
     parser.add_argument('-s', '--startframe', type=int, default=0, help='Set a start frame (ignore all frames before that frame)')
     parser.add_argument('-f', '--filter', action='store_true', help='Apply filter to detect frames')
+    parser.add_argument('-n', '--stride', type=int, default=1, help='Only save every n-th frame from the start frame on (default: 1, all frames)')
+    parser.add_argument('-w', '--workers', type=int, help='Number of threads filtering and encoding frames (default: number of CPUs)')
+    parser.add_argument('-d', '--detect-dim', type=int, help='Run the filter on a downscaled copy with this longest side in pixels (default: full resolution)')
 
     args = parser.parse_args()
 
@@ -83,10 +118,12 @@ def main():
 
     print(f"Input video: {video_path}")
     print(f"Starting from frame: {start_frame}")
+    if args.stride > 1:
+        print(f"Saving every {args.stride}th frame.")
     if apply_filter:
         print("Only saving detectable images.")
 
-    split_video_frames(video_path, start_frame, apply_filter)
+    split_video_frames(video_path, start_frame, apply_filter, args.detect_dim, max(args.stride, 1), args.workers)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
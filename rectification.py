@@ -1,85 +1,297 @@
 import cv2
 import numpy as np
 import os
+import time
 import argparse
 
-def main(name, input_folder_l, input_folder_r, output_folder):
+from src.parallel import resolve_workers
+from src.pipeline import Pipeline
+from src.rectify import INTERPOLATIONS, STEREO_MAP_ARRAYS, StereoRectifier
+from src.image_writer import write_image
+from src.instrumentation import add_instrumentation_arguments, enable_from_args, metrics
+from src.manifest import Manifest, add_manifest_arguments
+from src.stereo_map import load_stereo_map
+
+def benchmark(name, input_folder_l, input_folder_r, num_pairs=10, crop=False):
+    # Time remapping and JPEG encoding of the first pairs with every interpolation mode
+    stereo_map = load_stereo_map(name, STEREO_MAP_ARRAYS)
+
+    pairs = []
+    for counter in range(num_pairs):
+        img_l = cv2.imread(f"{input_folder_l}/left_image_{counter}.jpg")
+        img_r = cv2.imread(f"{input_folder_r}/right_image_{counter}.jpg")
+        if img_l is None or img_r is None:
+            break
+        pairs.append((img_l, img_r))
+
+    if not pairs:
+        print("[ERROR]\tNo image pairs found for the benchmark.")
+        return
+
+    print(f"[INFO]\tTiming {len(pairs)} pairs per mode (single thread, crop: {crop})")
+    print("      \tmode      remap [ms/pair]  encode [ms/pair]  pairs/s")
+
+    # remap and imencode use OpenCV's own thread pool, limit it so the times are per core
+    num_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1)
+    try:
+        for interpolation in INTERPOLATIONS:
+            rectifier = StereoRectifier(stereo_map, interpolation, crop)
+
+            start = time.perf_counter()
+            rectified = [rectifier.rectify(img_l, img_r) for img_l, img_r in pairs]
+            remap_time = (time.perf_counter() - start) / len(pairs)
+
+            start = time.perf_counter()
+            for rect_img_l, rect_img_r in rectified:
+                cv2.imencode('.jpg', rect_img_l)
+                cv2.imencode('.jpg', rect_img_r)
+            encode_time = (time.perf_counter() - start) / len(pairs)
+
+            print(f"      \t{interpolation:<9} {remap_time * 1000:15.2f}  {encode_time * 1000:16.2f}  {1 / (remap_time + encode_time):7.1f}")
+    finally:
+        cv2.setNumThreads(num_threads)
+
+def load_rectifier(name, interpolation='lanczos', crop=False):
     print("[INFO]\tLoad rectification map.")
-    # Open the stereo map XML file
-    cv_file = cv2.FileStorage()
-    cv_file.open(f"data/out/stereo_map_{name}.xml", cv2.FILE_STORAGE_READ)
+    # Memory-map the binary stereo maps (converted from the XML file on first use)
+    stereo_map = load_stereo_map(name, STEREO_MAP_ARRAYS)
+    rectifier = StereoRectifier(stereo_map, interpolation, crop)
+    if rectifier.roi is not None:
+        print(f"[INFO]\tCropping rectified images to x={rectifier.roi[0]}, y={rectifier.roi[1]}, {rectifier.roi[2]}x{rectifier.roi[3]} px.")
+    return rectifier
+
+def list_pairs(input_folder_l, input_folder_r, start=0, stop=None):
+    # Image pairs are numbered consecutively, stop at the first missing pair or at the end of the id range
+    counter = start
+    while (stop is None or counter < stop) and \
+            os.path.isfile(f"{input_folder_l}/left_image_{counter}.jpg") and os.path.isfile(f"{input_folder_r}/right_image_{counter}.jpg"):
+        yield counter
+        counter += 1
+
+def pair_reader(input_folder_l, input_folder_r):
+    def load_pair(counter):
+        # Load both images
+        with metrics.stage("decode"):
+            img_l = cv2.imread(f"{input_folder_l}/left_image_{counter}.jpg")
+            img_r = cv2.imread(f"{input_folder_r}/right_image_{counter}.jpg")
 
-    # Read stereo maps
-    stereo_map_l_x = cv_file.getNode('stereo_map_l_x').mat()
-    stereo_map_l_y = cv_file.getNode('stereo_map_l_y').mat()
-    stereo_map_r_x = cv_file.getNode('stereo_map_r_x').mat()
-    stereo_map_r_y = cv_file.getNode('stereo_map_r_y').mat()
+        if img_l is None or img_r is None:
+            print(f"[ERROR]\tFailed to load image pair {counter}")
+            return None
+        return counter, img_l, img_r
 
-    # Close the XML file
-    cv_file.release()
+    return load_pair
 
+def video_pairs(cap):
+    # Runs in the pipeline's feeder thread, decoding is strictly sequential
+    frame_count = 0
+    while True:
+        with metrics.stage("decode"):
+            ret, frame = cap.read()
+        if not ret:
+            break
+        mid_index = frame.shape[1] // 2
+        yield frame_count, frame[:, :mid_index], frame[:, mid_index:]
+        frame_count += 1
+
+def pair_paths(output_folder, counter):
+    return (f"{output_folder}/rectified_left/rectified_left_image_{counter}.jpg",
+            f"{output_folder}/rectified_right/rectified_right_image_{counter}.jpg")
+
+def pair_writer(output_folder, verify_every=0, checksums=False):
     # Ensure output folders exists
     if not os.path.exists(f"{output_folder}/rectified_left"):
         os.makedirs(f"{output_folder}/rectified_left")
     if not os.path.exists(f"{output_folder}/rectified_right"):
         os.makedirs(f"{output_folder}/rectified_right")
 
-    counter = 0
+    def save_pair(pair):
+        counter, rect_img_l, rect_img_r = pair
 
-    print("[INFO]\tRectifying images...\n")
+        # Save the rectified images to the output folder
+        output_path_l, output_path_r = pair_paths(output_folder, counter)
 
-    while True:
-        if counter % 100 == 0:
-            print(f"      \t... Processed {counter} images...", end="\r")
-        # Load both images
-        image_path_r = f"{input_folder_r}/right_image_{counter}.jpg"
-        image_path_l = f"{input_folder_l}/left_image_{counter}.jpg"
-        img_r = cv2.imread(image_path_r)
-        img_l = cv2.imread(image_path_l)
-
-        # quit process when all images are processed
-        if img_r is None or img_l is None:
-            print(f"[INFO]\tAll {counter} images rectified.")
-            break
+        # Validate the encoded images in memory, decode them again only for every n-th pair
+        verify = verify_every > 0 and counter % verify_every == 0
+
+        written_l = write_image(output_path_l, rect_img_l, verify, checksum=checksums)
+        if not written_l:
+            print(f"[ERROR]\tSaved left image is faulty: {output_path_l}")
+            metrics.count("faulty_writes")
+            return None
+        written_r = write_image(output_path_r, rect_img_r, verify, checksum=checksums)
+        if not written_r:
+            print(f"[ERROR]\tSaved right image is faulty: {output_path_r}")
+            metrics.count("faulty_writes")
+            return None
+        # With checksums, the CRC32 of both encoded images is passed on to the manifest
+        return counter, [written_l, written_r] if checksums else None
+
+    return save_pair
+
+def main(name, input_folder_l, input_folder_r, output_folder, workers=None, io_threads=2, verify_every=0,
+         interpolation='lanczos', crop=False, id_range=None, resume=False, checksums=False, fresh=False):
+    workers = resolve_workers(workers)
+    start, stop = id_range or (0, None)
+
+    rectifier = load_rectifier(name, interpolation, crop)
+
+    def rectify_pair(pair):
+        counter, img_l, img_r = pair
 
         # Apply stereo rectification maps
-        rect_img_l = cv2.remap(img_l, stereo_map_l_x, stereo_map_l_y, cv2.INTER_LANCZOS4, cv2.BORDER_CONSTANT, 0)
-        rect_img_r = cv2.remap(img_r, stereo_map_r_x, stereo_map_r_y, cv2.INTER_LANCZOS4, cv2.BORDER_CONSTANT, 0)
+        with metrics.stage("remap"):
+            rect_img_l, rect_img_r = rectifier.rectify(img_l, img_r)
+        return counter, rect_img_l, rect_img_r
 
-        # Save the rectified images to the output folder
-        output_path_l = f"{output_folder}/rectified_left/rectified_left_image_{counter}.jpg"
-        output_path_r = f"{output_folder}/rectified_right/rectified_right_image_{counter}.jpg"
+    # Reading, remapping and writing run in separate thread pools connected by bounded queues
+    pipeline = Pipeline(queue_size=4 * workers)
+    pipeline.add_stage("read", pair_reader(input_folder_l, input_folder_r), io_threads)
+    pipeline.add_stage("remap", rectify_pair, workers)
+    pipeline.add_stage("write", pair_writer(output_folder, verify_every, checksums), io_threads)
 
-        cv2.imwrite(output_path_l, rect_img_l)
-        cv2.imwrite(output_path_r, rect_img_r)
+    # Completed pairs are recorded in the manifest, so an interrupted run can be resumed
+    os.makedirs(output_folder, exist_ok=True)
+    settings = f"calibration={name};interpolation={interpolation};crop={crop}"
+    manifest = Manifest(f"{output_folder}/manifest.jsonl", resume, checksums, fresh, settings)
 
-        # Validate saved images by reloading them
-        saved_img_l = cv2.imread(output_path_l)
-        saved_img_r = cv2.imread(output_path_r)
+    counter = 0
 
-        if saved_img_l is None:
-            print(f"[ERROR]\tSaved left image is faulty: {output_path_l}")
-            continue
-        if saved_img_r is None:
-            print(f"[ERROR]\tSaved right image is faulty: {output_path_r}")
-            continue
+    print("[INFO]\tRectifying images...\n")
+
+    pairs = manifest.pending(list_pairs(input_folder_l, input_folder_r, start, stop),
+                             outputs=lambda pair_id: pair_paths(output_folder, pair_id))
+
+    try:
+        for pair_id, written in pipeline.run(pairs):
+            manifest.record(pair_id, pair_paths(output_folder, pair_id), written)
+            # Increment the counter
+            counter += 1
+            metrics.progress()
+            if counter % 100 == 0:
+                print(f"      \t... Processed {counter} images...", end="\r")
+    finally:
+        manifest.close()
 
-        # Increment the counter
-        counter += 1
     print("                                                                                    ", end="\r")
+    if manifest.skipped:
+        print(f"[INFO]\tSkipped {manifest.skipped} pairs completed by an earlier run.")
     print(f"[INFO]\t... Rectification of {counter} images complete!")
+    pipeline.print_stats()
+    metrics.record_pipeline(pipeline)
     return
 
+def main_video(name, video_path, output_folder=None, video_out=None, workers=None, io_threads=2, verify_every=0,
+               interpolation='lanczos', crop=False):
+    # Decode a side-by-side stereo video once and rectify the halves in memory,
+    # without writing and re-reading split JPEGs
+    workers = resolve_workers(workers)
+
+    rectifier = load_rectifier(name, interpolation, crop)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"[ERROR]\tCannot open video file: {video_path}")
+        return
+
+    def rectify_pair(pair):
+        counter, img_l, img_r = pair
+        with metrics.stage("remap"):
+            rect_img_l, rect_img_r = rectifier.rectify(img_l, img_r)
+        return counter, rect_img_l, rect_img_r
+
+    pipeline = Pipeline(queue_size=4 * workers)
+    pipeline.add_stage("remap", rectify_pair, workers)
+
+    if output_folder is not None:
+        save_pair = pair_writer(output_folder, verify_every)
+        if video_out is None:
+            pipeline.add_stage("write", save_pair, io_threads)
+        else:
+            def save_and_keep_pair(pair):
+                # Keep the pair for the video even if its JPEGs could not be written
+                save_pair(pair)
+                return pair
+
+            pipeline.add_stage("write", save_and_keep_pair, io_threads)
+
+    writer = None
+    pending = {}
+    next_frame = 0
+    counter = 0
+
+    print("[INFO]\tRectifying video frames...\n")
+
+    try:
+        for result in pipeline.run(video_pairs(cap)):
+            counter += 1
+            metrics.progress()
+            if counter % 100 == 0:
+                print(f"      \t... Processed {counter} frames...", end="\r")
+
+            if video_out is None:
+                continue
+
+            # Frames finish out of order, the video has to be written in order
+            pending[result[0]] = result
+            while next_frame in pending:
+                _, rect_img_l, rect_img_r = pending.pop(next_frame)
+                frame = cv2.hconcat([rect_img_l, rect_img_r])
+                if writer is None:
+                    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+                    fourcc = cv2.VideoWriter_fourcc(*('MJPG' if video_out.lower().endswith('.avi') else 'mp4v'))
+                    writer = cv2.VideoWriter(video_out, fourcc, fps, (frame.shape[1], frame.shape[0]))
+                with metrics.stage("video_write"):
+                    writer.write(frame)
+                next_frame += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+
+    print("                                                                                    ", end="\r")
+    print(f"[INFO]\t... Rectification of {counter} video frames complete!")
+    pipeline.print_stats()
+    metrics.record_pipeline(pipeline)
+
 if __name__ == '__main__':
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Stereo image rectification.")
     parser.add_argument('-n', '--name', default="new", help="Name identifier for the stereo rectification maps (default: new).")
-    parser.add_argument('-r', '--right', help="Input folder containing the right images.", required=True)
-    parser.add_argument('-l', '--left', help="Input folder containing the left images.", required=True)
-    parser.add_argument('-o', '--out', help="Output folder to save the rectified images.", required=True)
+    parser.add_argument('-r', '--right', help="Input folder containing the right images.")
+    parser.add_argument('-l', '--left', help="Input folder containing the left images.")
+    parser.add_argument('-v', '--video', help="Side-by-side stereo video to rectify directly, instead of image folders.")
+    parser.add_argument('-o', '--out', help="Output folder to save the rectified images.")
+    parser.add_argument('--video-out', help="With --video, write the rectified pairs side by side to this video file.")
+    parser.add_argument('-w', '--workers', type=int, help="Number of threads remapping images (default: number of CPUs).")
+    parser.add_argument('--io-threads', type=int, default=2, help="Number of threads reading and writing images each (default: 2).")
+    parser.add_argument('--verify-every', type=int, default=0, help="Decode every n-th written pair again to verify it (default: 0, only in-memory checks).")
+    parser.add_argument('-i', '--interpolation', choices=list(INTERPOLATIONS), default='lanczos', help="Interpolation used for remapping (default: lanczos).")
+    parser.add_argument('-c', '--crop', action='store_true', help="Crop the rectified images to the region valid in both images.")
+    parser.add_argument('--benchmark', type=int, metavar='N', help="Only time every interpolation mode on the first N pairs and exit.")
+    add_manifest_arguments(parser)
+    add_instrumentation_arguments(parser)
     args = parser.parse_args()
 
-    main(args.name, args.left, args.right, args.out)
+    enable_from_args("rectification", args)
+
+    if args.video is not None:
+        if args.out is None and args.video_out is None:
+            parser.error("--video requires -o/--out and/or --video-out")
+        main_video(args.name, args.video, args.out, args.video_out, args.workers, args.io_threads, args.verify_every,
+                   args.interpolation, args.crop)
+    elif args.left is None or args.right is None:
+        parser.error("the following arguments are required: -l/--left, -r/--right (or -v/--video)")
+    elif args.benchmark is not None:
+        benchmark(args.name, args.left, args.right, args.benchmark, args.crop)
+    elif args.out is None:
+        parser.error("the following arguments are required: -o/--out")
+    else:
+        main(args.name, args.left, args.right, args.out, args.workers, args.io_threads, args.verify_every,
+             args.interpolation, args.crop, args.range, args.resume, args.checksums, args.fresh)
+
+    metrics.close()
 
 # Example Usage:
 # python rectification.py -n run_2 -r "D:/fft out/start_dataset/Stereo_images_right" -l "D:\fft out\start_dataset\Stereo_images_left" -o "D:\fft out\start_dataset\rectification"
\ No newline at end of file
@@ -1,7 +1,35 @@
+import os
+
 import cv2
 import numpy as np
 
-def calibrate_camera(images, pattern_size, square_size, visualize=True):
+from src.chessboard_detection import detect_corners
+from src.image_source import read_image
+from src.reprojection import calibrate_with_pruning, save_view_errors
+
+def calibrate_camera(images, pattern_size, square_size, visualize=True, workers=None, corner_set=None, max_dim=None,
+                     prune=False, outlier_factor=2.0, max_view_error=None, report_path=None, initial=None):
+    """
+    Calibrate a camera from chessboard images.
+
+    Args:
+    - images: Images, image paths or an ImageSource (only read for detection and visualization).
+    - pattern_size: Inner corners of the chessboard (columns, rows).
+    - square_size: Size of a chessboard square.
+    - visualize: Show the detected corners (default: True).
+    - workers: Number of detection processes (default: number of CPUs).
+    - corner_set: Corners detected by an earlier stage (default: None, detect them).
+    - max_dim: Longest side of the downscaled detection copy (default: None, full resolution).
+    - prune: Iteratively drop outlier views and refit (default: False). Dropped views are marked
+      as not detected in the corner set, so later stages sharing it skip them too.
+    - outlier_factor, max_view_error: Outlier thresholds, see src.reprojection.calibrate_with_pruning.
+    - report_path: Write the per-view reprojection errors to this CSV file (default: None).
+    - initial: (camera_matrix, distortion_coeffs) of an earlier calibration to start the solver
+      from (default: None, solve from scratch).
+
+    Returns:
+    - rmse, camera_matrix, distortion_coeffs (None each if no chessboard was found).
+    """
     # Criteria used by checkerboard pattern detector
     termination_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
 
@@ -14,27 +42,46 @@ def calibrate_camera(images, pattern_size, square_size, visualize=True):
     obj_p[:, :2] = np.mgrid[0:pattern_size[0], 0:pattern_size[1]].T.reshape(-1, 2)
     obj_p *= square_size
 
-    for img in images:
-        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        success, corners = cv2.findChessboardCorners(gray_img, pattern_size, None)  # Directly use pattern_size
+    # Reuse corners detected by an earlier stage if given
+    if corner_set is None:
+        corner_set = detect_corners(images, pattern_size, termination_criteria, workers, max_dim)
 
+    views = []
+    for i, (success, corners) in enumerate(corner_set):
         if success:
-            corners2 = cv2.cornerSubPix(gray_img, corners, (11, 11), (-1, -1), termination_criteria)
-            if visualize:
-                cv2.drawChessboardCorners(img, pattern_size, corners2, success)
+            views.append(i)
+            if visualize and images is not None:
+                img = images[i]
+                if isinstance(img, str):
+                    img = read_image(img)
+                cv2.drawChessboardCorners(img, pattern_size, corners, success)
                 cv2.imshow('Chessboard Detection', img)
                 cv2.waitKey(500)
             object_points.append(obj_p)
             image_points.append(corners)
 
-    cv2.destroyAllWindows()
+    if visualize:
+        cv2.destroyAllWindows()
 
     # Perform camera calibration
     if len(object_points) > 0 and len(image_points) > 0:
-        rmse, camera_matrix, distortion_coeffs, rvecs, tvecs = cv2.calibrateCamera(
-            object_points, image_points, gray_img.shape[::-1], None, None
+        img_size = corner_set.image_size
+        # Without pruning this is a single fit, the per-view errors come from one batched projection
+        initial_mtx, initial_dist = initial if initial is not None else (None, None)
+        rmse, camera_matrix, distortion_coeffs, view_errors, pruned = calibrate_with_pruning(
+            object_points, image_points, img_size,
+            outlier_factor if prune else None, max_view_error if prune else None,
+            camera_matrix=initial_mtx, distortion_coeffs=initial_dist
         )
-        #opt_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, distortion_coeffs, gray_img.shape[::-1], 1, gray_img.shape[::-1])
+
+        for view in pruned:
+            corner_set.success[views[view]] = False
+
+        names = [_view_name(images, i) for i in views]
+        _print_view_errors(view_errors, pruned, names)
+        if report_path is not None:
+            save_view_errors(view_errors, pruned, report_path, names)
+        #opt_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, distortion_coeffs, img_size, 1, img_size)
         print("Camera Matrix:\n", camera_matrix)
         #print("Optimized Camera Matrix:\n", opt_camera_matrix)
         print("Distortion Coefficients:\n", distortion_coeffs)
@@ -45,6 +92,24 @@ def calibrate_camera(images, pattern_size, square_size, visualize=True):
         return None, None, None
     
 
+def _view_name(images, index):
+    # Image path if known, otherwise the index of the image
+    paths = getattr(images, 'paths', images)
+    if paths is not None and isinstance(paths[index], str):
+        return paths[index]
+    return str(index)
+
+
+def _print_view_errors(view_errors, pruned, names):
+    print("Per-View Reprojection Errors [px]:")
+    order = np.argsort(view_errors)[::-1]
+    for view in order:
+        status = " (pruned)" if view in pruned else ""
+        print(f"  {view_errors[view]:8.4f}  {names[view]}{status}")
+    if pruned:
+        print(f"Pruned {len(pruned)} of {len(view_errors)} views.")
+
+
 def save_camera_calibration(rmse, camera_matrix, distortion_coeffs, file_path):
     # Write to the file
     with open(file_path, 'w') as file:
@@ -54,4 +119,42 @@ def save_camera_calibration(rmse, camera_matrix, distortion_coeffs, file_path):
         file.write("Distortion Coefficients:\n")
         np.savetxt(file, distortion_coeffs, fmt='%f')
 
-    print(f"Calibration parameters saved to {file_path}")
\ No newline at end of file
+    # Full precision copy, read back by load_camera_calibration
+    np.savez(os.path.splitext(file_path)[0] + ".npz", rmse=rmse, camera_matrix=camera_matrix, distortion_coeffs=distortion_coeffs)
+
+    print(f"Calibration parameters saved to {file_path}")
+
+
+def load_camera_calibration(file_path):
+    """
+    Load a calibration written by save_camera_calibration.
+
+    The .npz file next to the text file is preferred, calibrations saved before it existed are
+    parsed from the text file (6 decimals).
+
+    Args:
+    - file_path: Path of the calibration text file.
+
+    Returns:
+    - rmse, camera_matrix, distortion_coeffs, or None if there is no calibration.
+    """
+    npz_path = os.path.splitext(file_path)[0] + ".npz"
+    if os.path.isfile(npz_path):
+        with np.load(npz_path) as data:
+            return float(data['rmse']), data['camera_matrix'], data['distortion_coeffs']
+
+    if not os.path.isfile(file_path):
+        return None
+
+    with open(file_path) as file:
+        lines = [line.strip() for line in file if line.strip()]
+    try:
+        rmse = float(lines[0].split(":")[1])
+        matrix_start = lines.index("Camera Matrix:") + 1
+        dist_start = lines.index("Distortion Coefficients:") + 1
+        camera_matrix = np.loadtxt(lines[matrix_start:matrix_start + 3], ndmin=2)
+        distortion_coeffs = np.loadtxt(lines[dist_start:], ndmin=2)
+    except (IndexError, ValueError) as e:
+        print(f"[WARNING]\tCould not parse calibration file {file_path}: {e}")
+        return None
+    return rmse, camera_matrix, distortion_coeffs.reshape(1, -1)
@@ -0,0 +1,159 @@
+from functools import partial
+
+import cv2
+import numpy as np
+
+from src.image_source import ImageSource, read_image
+from src.instrumentation import metrics
+from src.parallel import process_map, resolve_workers
+
+# Criteria used by the sub-pixel corner refinement
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+SUBPIX_WINDOW = (11, 11)
+
+# Default flags of cv2.findChessboardCorners
+DETECTION_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
+
+
+class CornerSet:
+    """
+    Chessboard corners detected once in a sequence of images, shared by all calibration stages.
+
+    Attributes:
+    - success: Detection result per image.
+    - corners: Refined corners per image (None where no chessboard was found).
+    - image_sizes: (width, height) per image (None where the image could not be read).
+    - image_size: (width, height) of the images.
+    """
+
+    def __init__(self, success, corners, image_sizes):
+        self.success = list(success)
+        self.corners = list(corners)
+        self.image_sizes = list(image_sizes)
+        self.image_size = next((size for size in self.image_sizes if size is not None), None)
+
+    def __len__(self):
+        return len(self.success)
+
+    def __iter__(self):
+        return zip(self.success, self.corners)
+
+    def num_detected(self):
+        return sum(self.success)
+
+
+def to_gray(image):
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def find_chessboard(image, pattern_size, max_dim=None, flags=DETECTION_FLAGS):
+    """
+    Search the chessboard without sub-pixel refinement.
+
+    If max_dim is set and the image is larger, the search runs on a downscaled copy whose
+    longest side is max_dim pixels (with CALIB_CB_FAST_CHECK, so images without a board are
+    rejected early) and the found corners are scaled back to full-resolution coordinates.
+
+    Args:
+    - image: BGR or grayscale image.
+    - pattern_size: Number of inner corners per chessboard row and column.
+    - max_dim: Longest image side used for the search (default: None, full resolution).
+    - flags: Flags passed to cv2.findChessboardCorners.
+
+    Returns:
+    - success: True if the chessboard was found.
+    - corners: Corners in full-resolution pixel coordinates (None if not found).
+    """
+    gray = to_gray(image)
+
+    if not max_dim or max(gray.shape) <= max_dim:
+        success, corners = cv2.findChessboardCorners(gray, pattern_size, flags=flags)
+        return (True, corners) if success else (False, None)
+
+    scale = max_dim / max(gray.shape)
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    success, corners = cv2.findChessboardCorners(small, pattern_size, flags=flags | cv2.CALIB_CB_FAST_CHECK)
+
+    if not success:
+        return False, None
+
+    # Map pixel centres of the downscaled image back to the full image
+    corners = ((corners + 0.5) / scale - 0.5).astype(np.float32)
+    return True, corners
+
+
+def detect_chessboard(image, pattern_size, criteria=SUBPIX_CRITERIA, max_dim=None):
+    """
+    Detect the chessboard in a single image and refine the corners to sub-pixel accuracy.
+
+    Args:
+    - image: BGR or grayscale image.
+    - pattern_size: Number of inner corners per chessboard row and column.
+    - criteria: Termination criteria of the sub-pixel refinement.
+    - max_dim: Longest image side used for the coarse search (default: None, full resolution).
+      The sub-pixel refinement always runs on the full-resolution image.
+
+    Returns:
+    - success: True if the chessboard was found.
+    - corners: Refined corners (None if not found).
+    """
+    gray = to_gray(image)
+    success, corners = find_chessboard(gray, pattern_size, max_dim)
+
+    if not success:
+        return False, None
+
+    corners = cv2.cornerSubPix(gray, corners, SUBPIX_WINDOW, (-1, -1), criteria)
+    return True, corners
+
+
+def _detect_item(image, pattern_size, criteria, max_dim, collect_metrics=False):
+    if collect_metrics:
+        metrics.enable_worker("detection worker")
+
+    # Paths are read by the worker itself, so only the file name has to be sent to the process
+    if isinstance(image, str):
+        image = read_image(image, grayscale=True)
+    if image is None:
+        return False, None, None, metrics.drain()
+
+    with metrics.stage("chessboard_search"):
+        success, corners = detect_chessboard(image, pattern_size, criteria, max_dim)
+    # Timings of this image, merged by the main process
+    return success, corners, image.shape[1::-1], metrics.drain()
+
+
+def detect_corners(images, pattern_size, criteria=SUBPIX_CRITERIA, workers=None, max_dim=None):
+    """
+    Detect the chessboard in every image, spread over a pool of worker processes.
+
+    Args:
+    - images: Iterable of BGR or grayscale images, of image file paths, or an ImageSource.
+    - pattern_size: Number of inner corners per chessboard row and column.
+    - criteria: Termination criteria of the sub-pixel refinement.
+    - workers: Number of worker processes (default: number of CPUs, 1 runs in-process).
+    - max_dim: Longest image side used for the coarse search (default: None, full resolution).
+
+    Returns:
+    - CornerSet with the results in the same order as the images.
+    """
+    # Worker processes decode the files of an image source themselves, in-process detection
+    # consumes the source lazily through its prefetch thread
+    workers = resolve_workers(workers)
+    if isinstance(images, ImageSource) and workers > 1:
+        images = images.paths
+
+    detect = partial(_detect_item, pattern_size=pattern_size, criteria=criteria, max_dim=max_dim,
+                     collect_metrics=metrics.enabled)
+    results = []
+    for success, corners, size, timings in process_map(detect, images, workers):
+        metrics.merge(timings)
+        results.append((success, corners, size))
+
+    if not results:
+        return CornerSet([], [], [])
+
+    success, corners, sizes = zip(*results)
+    return CornerSet(success, corners, sizes)
@@ -0,0 +1,44 @@
+import cv2
+import numpy as np
+
+# 256-entry BGR lookup tables per colormap name, built once per process
+_luts = {}
+
+
+def colormap_lut(colormap='inferno_r'):
+    """
+    Lookup table with the 256 colours of a matplotlib colormap, as 256x1x3 BGR uint8 array.
+    """
+    if colormap not in _luts:
+        # Only needed to build the table, the colorization itself does not use matplotlib
+        from matplotlib import colormaps
+
+        rgba = colormaps[colormap](np.arange(256))
+        bgr = np.round(rgba[:, 2::-1] * 255).astype(np.uint8)
+        _luts[colormap] = bgr.reshape(256, 1, 3)
+    return _luts[colormap]
+
+
+def colorize(depth_map, colormap='inferno_r', vmin=0, vmax=3):
+    """
+    Map a depth map to colours with the same scaling as plt.imshow(cmap=colormap, vmin=vmin, vmax=vmax).
+
+    Values below vmin and above vmax get the first and last colour of the colormap,
+    NaN pixels are white.
+
+    Returns:
+    - BGR uint8 image with the resolution of the depth map.
+    """
+    nan_mask = np.isnan(depth_map)
+
+    # Same binning as matplotlib: [vmin, vmax] is split into 256 equally sized bins
+    scaled = np.subtract(depth_map, vmin, dtype=np.float32)
+    scaled *= 256 / (vmax - vmin)
+    np.nan_to_num(scaled, copy=False, nan=0, posinf=255, neginf=0)
+    np.clip(scaled, 0, 255, out=scaled)
+    indices = scaled.astype(np.uint8)
+
+    colored = cv2.LUT(cv2.cvtColor(indices, cv2.COLOR_GRAY2BGR), colormap_lut(colormap))
+    if nan_mask.any():
+        colored[nan_mask] = 255
+    return colored
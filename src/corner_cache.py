@@ -0,0 +1,120 @@
+import hashlib
+import os
+
+import numpy as np
+
+from src.chessboard_detection import CornerSet, SUBPIX_CRITERIA, SUBPIX_WINDOW, detect_corners
+
+
+def image_hash(file_path, chunk_size=1 << 20):
+    # Hash the encoded file content, so unchanged images never have to be decoded
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _settings_key(pattern_size, criteria, max_dim):
+    # Cached corners are only valid for the detection settings they were produced with
+    return f"pattern={tuple(pattern_size)};window={SUBPIX_WINDOW};criteria={tuple(criteria)};max_dim={max_dim}"
+
+
+def load_corner_cache(cache_path, settings):
+    """
+    Load the cached detections from a .npz file.
+
+    Returns:
+    - Dictionary mapping image hash to (success, corners, image_size). Empty if the file
+      does not exist or was written with different detection settings.
+    """
+    if not os.path.isfile(cache_path):
+        return {}
+
+    try:
+        with np.load(cache_path) as data:
+            if str(data['settings']) != settings:
+                print(f"[INFO]\tDetection settings changed, ignoring corner cache {cache_path}")
+                return {}
+            hashes = data['hashes']
+            success = data['success']
+            corners = data['corners']
+            sizes = data['sizes']
+    except (OSError, KeyError, ValueError) as e:
+        print(f"[WARNING]\tFailed to read corner cache {cache_path}: {e}")
+        return {}
+
+    entries = {}
+    for i, key in enumerate(hashes):
+        image_size = (int(sizes[i][0]), int(sizes[i][1]))
+        entries[str(key)] = (bool(success[i]), corners[i] if success[i] else None, image_size)
+    return entries
+
+
+def save_corner_cache(cache_path, settings, entries, num_corners):
+    hashes = list(entries.keys())
+    success = np.zeros(len(hashes), dtype=bool)
+    corners = np.full((len(hashes), num_corners, 1, 2), np.nan, dtype=np.float32)
+    sizes = np.zeros((len(hashes), 2), dtype=np.int32)
+
+    for i, key in enumerate(hashes):
+        found, image_corners, image_size = entries[key]
+        success[i] = found
+        sizes[i] = image_size
+        if found:
+            corners[i] = np.reshape(image_corners, (num_corners, 1, 2))
+
+    np.savez_compressed(cache_path, settings=np.array(settings), hashes=np.array(hashes),
+                        success=success, corners=corners, sizes=sizes)
+
+
+def detect_corners_cached(image_paths, pattern_size, cache_path, criteria=SUBPIX_CRITERIA, workers=None, max_dim=None,
+                          hashes=None, in_use=None):
+    """
+    Detect the chessboard corners of all images, only running the detection for images
+    that are not yet in the on-disk cache.
+
+    Entries of images that are no longer part of the set (removed or replaced) are dropped
+    from the cache, which is only rewritten when entries were added or dropped.
+
+    Args:
+    - image_paths: List of image file paths.
+    - pattern_size: Number of inner corners per chessboard row and column.
+    - cache_path: Path of the .npz corner cache of this calibration set.
+    - criteria: Termination criteria of the sub-pixel refinement.
+    - workers: Number of worker processes used for the detection of new images.
+    - max_dim: Longest image side used for the coarse search (default: None, full resolution).
+    - hashes: image_hash of every image, if already computed (default: None, hashed here).
+    - in_use: Hashes of other images sharing the cache file, e.g. the other side of a stereo
+      set, whose entries are kept (default: None, only the entries of these images are kept).
+
+    Returns:
+    - CornerSet with the results in the same order as the image paths.
+    """
+    settings = _settings_key(pattern_size, criteria, max_dim)
+    entries = load_corner_cache(cache_path, settings)
+
+    if hashes is None:
+        hashes = [image_hash(path) for path in image_paths]
+    missing = [i for i, key in enumerate(hashes) if key not in entries]
+
+    if missing:
+        print(f"[INFO]\tDetecting chessboards in {len(missing)} of {len(image_paths)} images...")
+        detected = detect_corners([image_paths[i] for i in missing], pattern_size, criteria, workers, max_dim)
+        for i, (success, corners), image_size in zip(missing, detected, detected.image_sizes):
+            entries[hashes[i]] = (success, corners, image_size)
+    else:
+        print(f"[INFO]\tLoaded chessboard corners of {len(image_paths)} images from {cache_path}")
+
+    # Images that could not be read are retried on the next run instead of being cached
+    keep = set(hashes) | set(in_use or ())
+    kept = {key: entry for key, entry in entries.items() if key in keep and entry[2] is not None}
+    if missing or len(kept) != len(entries):
+        save_corner_cache(cache_path, settings, kept, pattern_size[0] * pattern_size[1])
+
+    results = [entries[key] for key in hashes]
+    if not results:
+        return CornerSet([], [], [])
+
+    success, corners, sizes = zip(*results)
+    return CornerSet(success, corners, sizes)
@@ -0,0 +1,146 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.colormap import colorize
+from src.image_writer import write_image
+from src.manifest import buffer_checksum
+
+EPSILON = 1e-6  # Smallest disparity magnitude, avoids division by zero
+
+
+def projection_depth_constants(P1, P2):
+    """
+    Derive the constants of the disparity to depth conversion from the projection matrices.
+
+    Args:
+    - P1: 3x4 projection matrix for the left camera.
+    - P2: 3x4 projection matrix for the right camera.
+
+    Returns:
+    - focal_baseline: Focal length times baseline.
+    - offset: Principal point offset added to the disparity (cx_right - cx_left).
+    """
+    f_x = P1[0, 0]  # Focal length in x-direction
+    cx_left = P1[0, 2]  # Principal point x-coordinate of the left camera
+    cx_right = P2[0, 2]  # Principal point x-coordinate of the right camera
+    baseline = np.abs(P2[0, 3] / f_x)  # Baseline between the two cameras
+
+    return float(f_x * baseline), float(cx_right - cx_left)
+
+
+def depth_from_disparity(disparity, focal_baseline, offset, out=None):
+    """
+    Convert disparities to depth, working in place on a float32 buffer.
+
+    Works on single maps as well as on stacks of maps (N x H x W).
+
+    Args:
+    - disparity: Disparity map(s), any numeric dtype (may be memory-mapped).
+    - focal_baseline, offset: Constants from projection_depth_constants.
+    - out: Preallocated float32 output buffer of the same shape (default: None, allocate one).
+
+    Returns:
+    - The depth map(s) (the out buffer if given).
+    """
+    if out is None:
+        out = np.empty(disparity.shape, dtype=np.float32)
+
+    np.add(disparity, offset, out=out, casting='unsafe')
+    np.abs(out, out=out)
+    np.maximum(out, EPSILON, out=out)
+    np.divide(focal_baseline, out, out=out)
+    return out
+
+
+def _q_row(disparity, Q, row, out, row_offset=0):
+    # out = Q[row, 0] * x + Q[row, 1] * y + Q[row, 2] * d + Q[row, 3], without homogeneous arrays
+    np.multiply(disparity, Q[row, 2], out=out, casting='unsafe')
+    out += Q[row, 3]
+    if Q[row, 0] != 0:
+        out += Q[row, 0] * np.arange(disparity.shape[-1], dtype=np.float32)
+    if Q[row, 1] != 0:
+        out += Q[row, 1] * np.arange(row_offset, row_offset + disparity.shape[-2], dtype=np.float32)[:, np.newaxis]
+    return out
+
+
+def q_depth_from_disparity(disparity, Q, out=None):
+    """
+    Compute only the Z coordinate of the reprojection with the Q matrix, in place on float32.
+
+    Equivalent to the Z channel of cv2.reprojectImageTo3D, works on single maps as well as
+    on stacks of maps (N x H x W). Pixels with zero homogeneous coordinate get an infinite depth.
+
+    Args:
+    - disparity: Disparity map(s), any numeric dtype (may be memory-mapped).
+    - Q: 4x4 Q matrix from cv2.stereoRectify.
+    - out: Preallocated float32 output buffer of the same shape (default: None, allocate one).
+
+    Returns:
+    - The depth map(s) (the out buffer if given).
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+    if out is None:
+        out = np.empty(disparity.shape, dtype=np.float32)
+
+    # Homogeneous coordinate W
+    _q_row(disparity, Q, 3, out)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if Q[2, 0] == 0 and Q[2, 1] == 0 and Q[2, 2] == 0:
+            # Standard Q matrix, the numerator is the constant focal length
+            np.divide(Q[2, 3], out, out=out)
+        else:
+            out[...] = _q_row(disparity, Q, 2, np.empty_like(out)) / out
+    return out
+
+
+def reproject_image_to_3d(disparity, Q, out=None, row_offset=0):
+    """
+    Reproject a disparity map to 3D points with the Q matrix (like cv2.reprojectImageTo3D).
+
+    Args:
+    - disparity: Disparity map (H x W), any numeric dtype.
+    - Q: 4x4 Q matrix from cv2.stereoRectify.
+    - out: Preallocated float32 output buffer (H x W x 3) (default: None, allocate one).
+    - row_offset: Image row of the first disparity row, to reproject a block of rows (default: 0).
+
+    Returns:
+    - The X, Y, Z coordinates per pixel (the out buffer if given).
+    """
+    Q = np.asarray(Q, dtype=np.float64)
+    if out is None:
+        out = np.empty(disparity.shape + (3,), dtype=np.float32)
+
+    w = _q_row(disparity, Q, 3, np.empty(disparity.shape, dtype=np.float32), row_offset)
+    row = np.empty_like(w)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(1, w, out=w)
+        for axis in range(3):
+            np.multiply(_q_row(disparity, Q, axis, row, row_offset), w, out=out[..., axis])
+    return out
+
+
+def save_depth_map(depth_map, output_depth_path, checksum=False):
+    # Save depth map as a floating-point image, with checksum encoded in memory and the CRC32 of the buffer returned
+    depth_pil_image = Image.fromarray(np.asarray(depth_map, dtype=np.float32), mode='F')
+    if not checksum:
+        depth_pil_image.save(output_depth_path)
+        return None
+
+    buffer = io.BytesIO()
+    depth_pil_image.save(buffer, format=Image.registered_extensions()[os.path.splitext(output_depth_path)[1].lower()])
+    data = buffer.getbuffer()
+    with open(output_depth_path, 'wb') as file:
+        file.write(data)
+    return buffer_checksum(data)
+
+
+def save_heatmap(depth_map, heatmap_file_path, colormap='inferno_r', vmin=0, vmax=3, checksum=False):
+    # Colorized through a lookup table and saved with the exact resolution of the depth map
+    written = write_image(heatmap_file_path, colorize(depth_map, colormap, vmin, vmax), checksum=checksum)
+    return written if checksum and written else None
@@ -0,0 +1,201 @@
+from functools import partial
+
+import cv2
+import numpy as np
+
+from src.chessboard_detection import find_chessboard, to_gray
+from src.instrumentation import metrics
+from src.parallel import process_map
+
+
+def board_pose_features(corners, pattern_size, image_size):
+    """
+    Describe where and how the chessboard appears in the image.
+
+    Returns:
+    - Array with the normalised board centre (x, y), the board scale (square root of the
+      covered image fraction) and the horizontal and vertical tilt (log ratio of the
+      lengths of opposite board edges).
+    """
+    points = np.reshape(corners, (-1, 2))
+    w, h = image_size
+    cols = pattern_size[0]
+
+    top_left, top_right = points[0], points[cols - 1]
+    bottom_left, bottom_right = points[-cols], points[-1]
+
+    center = points.mean(axis=0) / (w, h)
+    area = cv2.contourArea(np.array([top_left, top_right, bottom_right, bottom_left], np.float32))
+    scale = np.sqrt(area / (w * h))
+
+    top = np.linalg.norm(top_right - top_left)
+    bottom = np.linalg.norm(bottom_right - bottom_left)
+    left = np.linalg.norm(bottom_left - top_left)
+    right = np.linalg.norm(bottom_right - top_right)
+    tilt_x = np.log(left / right)
+    tilt_y = np.log(top / bottom)
+
+    return np.array([center[0], center[1], scale, tilt_x, tilt_y], np.float32)
+
+
+def board_sharpness(gray, corners):
+    # Variance of the Laplacian inside the board's bounding box, low for blurry frames
+    x, y, w, h = cv2.boundingRect(np.reshape(corners, (-1, 1, 2)).astype(np.float32))
+    roi = gray[max(y, 0):y + h, max(x, 0):x + w]
+    if roi.size == 0:
+        return 0.0
+    return float(cv2.Laplacian(roi, cv2.CV_64F).var())
+
+
+def analyse_frame(frame, pattern_size, stereo=False, max_dim=None):
+    """
+    Detect the chessboard in a frame and describe its pose.
+
+    Returns:
+    - features: Pose features of the board (left and right concatenated in stereo mode),
+      None if the chessboard is not visible (in both halves).
+    - sharpness: Sharpness of the least sharp detected board.
+    """
+    if stereo:
+        width = frame.shape[1]
+        views = [frame[:, :width // 2], frame[:, width // 2:]]
+    else:
+        views = [frame]
+
+    features = []
+    sharpness = []
+    for view in views:
+        gray = to_gray(view)
+        success, corners = find_chessboard(gray, pattern_size, max_dim)
+        if not success:
+            return None, 0.0
+        features.append(board_pose_features(corners, pattern_size, gray.shape[::-1]))
+        sharpness.append(board_sharpness(gray, corners))
+
+    return np.concatenate(features), min(sharpness)
+
+
+def _analyse_item(item, pattern_size, stereo, max_dim, collect_metrics=False):
+    if collect_metrics:
+        metrics.enable_worker("frame selection worker")
+
+    index, frame = item
+    with metrics.stage("frame_analysis"):
+        features, sharpness = analyse_frame(frame, pattern_size, stereo, max_dim)
+    return index, features, sharpness, metrics.drain()
+
+
+def _sample_frames(cap, stride):
+    # Decode only every <stride>-th frame, the others are grabbed without conversion
+    index = 0
+    while True:
+        if index % stride == 0:
+            successful, frame = cap.read()
+            if not successful:
+                break
+            yield index, frame
+        elif not cap.grab():
+            break
+        index += 1
+
+
+def select_diverse_frames(features, sharpness, target_count, min_distance=0.05, blur_ratio=0.5):
+    """
+    Pick a subset of frames with a good coverage of board poses.
+
+    Frames whose sharpness is below blur_ratio times the median sharpness are rejected. The
+    remaining frames are chosen greedily, each time taking the frame whose pose is farthest
+    from all frames already chosen, until target_count frames are chosen or only near
+    duplicates (pose distance below min_distance) are left.
+
+    Returns:
+    - Indices into the candidate list of the selected frames.
+    """
+    if len(features) == 0 or target_count <= 0:
+        return []
+
+    features = np.asarray(features)
+    sharpness = np.asarray(sharpness)
+
+    candidates = np.flatnonzero(sharpness >= blur_ratio * np.median(sharpness))
+
+    # Start with the sharpest frame
+    selected = [candidates[np.argmax(sharpness[candidates])]]
+    distances = np.linalg.norm(features[candidates] - features[selected[0]], axis=1)
+
+    while len(selected) < target_count:
+        best = np.argmax(distances)
+        if distances[best] < min_distance:
+            break
+        selected.append(candidates[best])
+        distances = np.minimum(distances, np.linalg.norm(features[candidates] - features[candidates[best]], axis=1))
+
+    return sorted(selected)
+
+
+def auto_select_frames(video_path, pattern_size, stereo=False, target_count=30, stride=5, max_dim=None, workers=None,
+                       min_distance=0.05, blur_ratio=0.5):
+    """
+    Select calibration frames from a video without user interaction.
+
+    The video is streamed once to detect the chessboard on every stride-th frame, the frames
+    are selected for pose diversity (see select_diverse_frames) and the video is streamed a
+    second time to collect the selected frames, so only those are held in memory.
+
+    Args:
+    - video_path: Path to the calibration video.
+    - pattern_size: Number of inner corners per chessboard row and column.
+    - stereo: If True, frames are side-by-side stereo pairs and the board must be found in both halves.
+    - target_count: Maximum number of frames to select.
+    - stride: Only every stride-th frame is analysed.
+    - max_dim: Longest image side used for the chessboard search (default: None, full resolution).
+    - workers: Number of worker processes used for the detection.
+    - min_distance: Minimum pose distance between two selected frames.
+    - blur_ratio: Frames with a sharpness below this fraction of the median are rejected.
+
+    Returns:
+    - List of the selected frames, None if the video cannot be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"[ERROR]\tCannot open video file {video_path}!")
+        return None
+
+    analyse = partial(_analyse_item, pattern_size=pattern_size, stereo=stereo, max_dim=max_dim, collect_metrics=metrics.enabled)
+
+    frame_indices = []
+    features = []
+    sharpness = []
+    analysed = 0
+    for index, frame_features, frame_sharpness, timings in process_map(analyse, _sample_frames(cap, max(stride, 1)), workers):
+        metrics.merge(timings)
+        analysed += 1
+        if analysed % 100 == 0:
+            print(f"      \t... Analysed {analysed} frames, {len(frame_indices)} with chessboard...", end="\r")
+        if frame_features is not None:
+            frame_indices.append(index)
+            features.append(frame_features)
+            sharpness.append(frame_sharpness)
+    cap.release()
+
+    print(f"[INFO]\tChessboard found in {len(frame_indices)} of {analysed} analysed frames.")
+
+    selected = {frame_indices[i] for i in select_diverse_frames(features, sharpness, target_count, min_distance, blur_ratio)}
+    if not selected:
+        return []
+
+    # Second pass, decode only the selected frames
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    last = max(selected)
+    for index in range(last + 1):
+        if index in selected:
+            successful, frame = cap.read()
+            if not successful:
+                break
+            frames.append(frame)
+        elif not cap.grab():
+            break
+    cap.release()
+
+    return frames
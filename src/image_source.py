@@ -0,0 +1,109 @@
+import os
+import queue
+import threading
+
+import cv2
+
+from src.instrumentation import metrics
+
+_END = object()
+
+
+def list_image_paths(folder_path, name, extension='png'):
+    # Images are numbered consecutively (<name>_0.<extension>, <name>_1.<extension>, ...)
+    image_paths = []
+
+    counter = 0
+    while True:
+        file_path = os.path.join(folder_path, f"{name}_{counter}.{extension}")
+
+        # Check if the file exists
+        if not os.path.isfile(file_path):
+            break
+
+        image_paths.append(file_path)
+        counter += 1
+
+    return image_paths
+
+
+def read_image(file_path, grayscale=False):
+    with metrics.stage("decode"):
+        image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR)
+    if image is None:
+        print(f"[WARNING]\tFailed to load image: {file_path}")
+    return image
+
+
+def iter_images(image_paths, grayscale=True, prefetch=0):
+    """
+    Lazily decode images one after another.
+
+    Args:
+    - image_paths: List of image file paths.
+    - grayscale: Decode directly to grayscale (default: True).
+    - prefetch: Number of images decoded ahead by a background thread (default: 0, no thread).
+
+    Returns:
+    - Generator of the images (None for images that could not be read).
+    """
+    if prefetch <= 0:
+        for file_path in image_paths:
+            yield read_image(file_path, grayscale)
+        return
+
+    images = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer stopped iterating, so the thread does not block forever
+        while not stop.is_set():
+            try:
+                images.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        for file_path in image_paths:
+            if not put(read_image(file_path, grayscale)):
+                return
+        put(_END)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            image = images.get()
+            if image is _END:
+                break
+            yield image
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ImageSource:
+    """
+    Calibration images that are only decoded while they are consumed, so at most a few
+    frames are held in memory at any time.
+
+    Iterating yields the decoded images (grayscale by default) in order, indexing reads
+    a single image in colour for visualisation.
+    """
+
+    def __init__(self, image_paths, grayscale=True, prefetch=2):
+        self.paths = list(image_paths)
+        self.grayscale = grayscale
+        self.prefetch = prefetch
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        return iter_images(self.paths, self.grayscale, self.prefetch)
+
+    def __getitem__(self, index):
+        return read_image(self.paths[index])
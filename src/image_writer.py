@@ -0,0 +1,50 @@
+import os
+
+import cv2
+
+from src.instrumentation import metrics
+from src.manifest import buffer_checksum
+
+# Trailing marker of complete files per format
+_END_MARKERS = {
+    '.jpg': b'\xff\xd9',
+    '.jpeg': b'\xff\xd9',
+    '.png': b'IEND\xaeB`\x82',
+}
+
+
+def write_image(file_path, image, verify=False, params=(), checksum=False):
+    """
+    Encode an image in memory and write it with a single write call.
+
+    The encoded buffer is checked before writing (successful encoding, end-of-image marker)
+    and the number of written bytes is compared to its size, so no read-back is needed.
+
+    Args:
+    - file_path: Output path, the extension selects the format.
+    - image: Image to save.
+    - verify: Additionally decode the written file to check it (default: False).
+    - params: Encoder parameters passed to cv2.imencode.
+    - checksum: Return the CRC32 of the encoded buffer instead of True (default: False).
+
+    Returns:
+    - True (with checksum: the CRC32 as 8 hex digits) if the image was written correctly, False otherwise.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    with metrics.stage("encode"):
+        success, buffer = cv2.imencode(extension, image, params)
+    if not success or buffer.size == 0:
+        return False
+
+    data = buffer.tobytes()
+    marker = _END_MARKERS.get(extension)
+    if marker is not None and not data.endswith(marker):
+        return False
+
+    with metrics.stage("disk_write"), open(file_path, 'wb') as file:
+        if file.write(data) != len(data):
+            return False
+
+    if verify and cv2.imread(file_path, cv2.IMREAD_UNCHANGED) is None:
+        return False
+    return buffer_checksum(data) if checksum else True
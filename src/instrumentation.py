@@ -0,0 +1,212 @@
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Instrumentation:
+    """
+    Stage timers and counters of a run, written as JSON lines.
+
+    Disabled by default, then stage() and count() do nothing and cost next to nothing, so the
+    calls can stay in the hot paths. Entry points enable the module-level `metrics` instance
+    with enable() and call close() at the end of the run.
+
+    Records (one JSON object per line, appended to the metrics file):
+    - {"event": "progress", ...}: Items done and items/s, at most every `interval` seconds.
+    - {"event": "summary", ...}: Wall time, per stage count, total and mean time, counters and
+      the pipeline stage statistics.
+
+    Times of a stage are summed over all threads, so stages run by several threads can add up to
+    more than the wall time. Work done in worker processes is only included if the workers send
+    their drain() results back to be merged.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.run = None
+        self.path = None
+        self.interval = 10.0
+        self.stages = {}
+        self.counters = {}
+        self.pipelines = {}
+        self._profiler = None
+        self._profile_path = None
+        self._start = time.perf_counter()
+        self._last_progress = (self._start, 0)
+        self._items = 0
+        self._pid = os.getpid()
+
+    def enable(self, run, path=None, profile_path=None, interval=10.0):
+        """
+        Start collecting.
+
+        Args:
+        - run: Name of the run, written to every record (e.g. the script name).
+        - path: JSON lines file the records are appended to (default: None, collect only).
+        - profile_path: Run cProfile on the calling thread and save the stats to this file,
+          readable with pstats or snakeviz (default: None, no profiling).
+        - interval: Minimum seconds between progress records (default: 10).
+        """
+        self._reset()
+        self.enabled = True
+        self.run = run
+        self.path = path
+        self.interval = interval
+        if profile_path is not None:
+            self._profile_path = profile_path
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def enable_worker(self, run):
+        """
+        Start collecting in a worker process, whose results are sent back with drain().
+
+        Spawned workers start disabled. Forked workers inherit the parent's state including its
+        stage times so far, which must not be sent back a second time, so they start afresh.
+        In-process "workers" keep collecting into the running instance.
+        """
+        if not self.enabled or self._pid != os.getpid():
+            self.enable(run)
+
+    def stage(self, name):
+        """
+        Context manager adding the time spent inside it to the stage.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, count=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            stage = self.stages.setdefault(name, [0, 0.0])
+            stage[0] += count
+            stage[1] += seconds
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def drain(self):
+        """
+        Return and clear the collected stage times, to send them from a worker process to the
+        main process, which adds them with merge().
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            stages, self.stages = self.stages, {}
+            counters, self.counters = self.counters, {}
+        return stages, counters
+
+    def merge(self, drained):
+        if not self.enabled or drained is None:
+            return
+        stages, counters = drained
+        for name, (count, seconds) in stages.items():
+            self.add_time(name, seconds, count)
+        for name, value in counters.items():
+            self.count(name, value)
+
+    def record_pipeline(self, pipeline):
+        # Per-stage statistics collected by src.pipeline.Pipeline
+        if not self.enabled:
+            return
+        self.pipelines.update({name: dict(stats) for name, stats in pipeline.stats.items()})
+
+    def progress(self, items=1):
+        """
+        Count finished items and write a progress record if the interval has passed.
+        """
+        if not self.enabled:
+            return
+        self._items += items
+        now = time.perf_counter()
+        last_time, last_items = self._last_progress
+        if now - last_time >= self.interval:
+            self._last_progress = (now, self._items)
+            self._write({
+                'event': 'progress',
+                'elapsed': round(now - self._start, 3),
+                'items': self._items,
+                'items_per_s': round((self._items - last_items) / (now - last_time), 3),
+            })
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            stages = {name: {'count': count, 'total_s': round(seconds, 6),
+                             'mean_ms': round(seconds / count * 1000, 3) if count else 0}
+                      for name, (count, seconds) in self.stages.items()}
+            counters = dict(self.counters)
+        record = {
+            'event': 'summary',
+            'elapsed': round(elapsed, 3),
+            'items': self._items,
+            'items_per_s': round(self._items / elapsed, 3) if elapsed > 0 else 0,
+            'stages': stages,
+            'counters': counters,
+        }
+        if self.pipelines:
+            record['pipeline'] = self.pipelines
+        if self._profile_path is not None:
+            record['profile'] = self._profile_path
+        return record
+
+    def close(self):
+        """
+        Stop profiling, write the summary record and disable collecting.
+        """
+        if not self.enabled:
+            return
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._profile_path)
+            print(f"[INFO]\tProfile saved to {self._profile_path}")
+        self._write(self.summary())
+        self.enabled = False
+
+    def _write(self, record):
+        if self.path is None:
+            return
+        record = {'run': self.run, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), **record}
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(record) + "\n")
+
+
+# Shared by all modules of a process, enabled by the entry points
+metrics = Instrumentation()
+
+
+def add_instrumentation_arguments(parser):
+    parser.add_argument('--metrics', metavar='PATH', help="Append per-stage timings, counters and periodic throughput to this JSON lines file.")
+    parser.add_argument('--profile', metavar='PATH', help="Profile the main thread with cProfile and save the stats to this file.")
+
+
+def enable_from_args(run, args, interval=10.0):
+    if args.metrics is not None or args.profile is not None:
+        metrics.enable(run, args.metrics, args.profile, interval)
@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from src.frame_selection import analyse_frame
+
+
+class LatestFrame:
+    """
+    Single-slot holder of the newest frame of a live stream.
+
+    The capture loop replaces the frame for every new one, so a slow consumer never blocks the
+    capture, only ever sees the newest frame and no more than one frame is held back.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frame = None
+        self.count = 0
+
+    def push(self, frame):
+        with self.lock:
+            self.frame = frame
+            self.count += 1
+
+    def latest(self):
+        """
+        Returns:
+        - (index, frame) of the newest frame, (None, None) before the first frame.
+        """
+        with self.lock:
+            if self.frame is None:
+                return None, None
+            return self.count - 1, self.frame
+
+
+class CoverageSelector:
+    """
+    Decide online whether a detected frame improves the coverage of board poses.
+
+    Online counterpart of frame_selection.select_diverse_frames: a frame is accepted if its pose
+    is at least min_distance away from all accepted frames and its sharpness is not below
+    blur_ratio times the median sharpness of the detections seen so far.
+    """
+
+    def __init__(self, min_distance=0.05, blur_ratio=0.5, warmup=5):
+        self.min_distance = min_distance
+        self.blur_ratio = blur_ratio
+        self.warmup = warmup
+        self.features = []
+        self.sharpness = deque(maxlen=100)
+
+    def offer(self, features, sharpness):
+        self.sharpness.append(sharpness)
+        if len(self.sharpness) >= self.warmup and sharpness < self.blur_ratio * np.median(self.sharpness):
+            return False
+        if self.features and np.min(np.linalg.norm(np.asarray(self.features) - features, axis=1)) < self.min_distance:
+            return False
+        self.features.append(features)
+        return True
+
+
+def open_stream(source):
+    # Digits select a camera device, anything else is opened as stream URL or file
+    if str(source).isdigit():
+        return cv2.VideoCapture(int(source)), True
+    return cv2.VideoCapture(source), False
+
+
+def live_select_frames(source, pattern_size, stereo=False, target_count=30, detect_rate=5.0, max_dim=None,
+                       preview=True, min_distance=0.05, blur_ratio=0.5):
+    """
+    Capture calibration frames from a live camera in one pass.
+
+    The main thread reads the stream into a LatestFrame slot and shows the preview. A background
+    thread takes the newest frame at most detect_rate times per second, searches the chessboard
+    and keeps the frame if it improves the pose coverage (see CoverageSelector), so the preview
+    never waits for the detection. An exception in the background thread stops the capture and
+    is re-raised here. Files and stream URLs are read at their frame rate, so a
+    recording can stand in for a camera.
+
+    Args:
+    - source: Camera device index, stream URL or video file.
+    - pattern_size: Number of inner corners per chessboard row and column.
+    - stereo: If True, frames are side-by-side stereo pairs and the board must be found in both halves.
+    - target_count: Stop after this many frames are captured.
+    - detect_rate: Maximum number of detections per second (default: 5).
+    - max_dim: Longest image side used for the chessboard search (default: None, full resolution).
+    - preview: Show the stream with the capture progress; 'q' stops, space captures the current
+      frame even if it does not improve the coverage (default: True).
+    - min_distance, blur_ratio: Selection thresholds, see CoverageSelector.
+
+    Returns:
+    - List of the captured frames, None if the stream cannot be opened.
+    """
+    cap, is_device = open_stream(source)
+    if not cap.isOpened():
+        print(f"[ERROR]\tCannot open camera or stream {source}!")
+        return None
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_time = 1.0 / fps if not is_device and fps > 0 else 0.0
+
+    latest = LatestFrame()
+    selector = CoverageSelector(min_distance, blur_ratio)
+    captured = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+    status = {'detected': False, 'analysed': 0}
+
+    def capture(index, frame, reason):
+        with lock:
+            captured.append(frame)
+            count = len(captured)
+        print(f"[INFO]\tFrame {index} captured ({reason}), {count}/{target_count}.")
+        if count >= target_count:
+            stop.set()
+
+    def detect():
+        last_index = None
+        try:
+            while not stop.is_set():
+                started = time.perf_counter()
+                index, frame = latest.latest()
+                if index is not None and index != last_index:
+                    last_index = index
+                    features, sharpness = analyse_frame(frame, pattern_size, stereo, max_dim)
+                    status['analysed'] += 1
+                    status['detected'] = features is not None
+                    if features is not None and selector.offer(features, sharpness):
+                        capture(index, frame, "new pose")
+                stop.wait(max(1.0 / detect_rate - (time.perf_counter() - started), 0.001))
+        except Exception as e:
+            # Stop the capture, the error is raised again in the capturing thread
+            errors.append(e)
+            stop.set()
+
+    detector = threading.Thread(target=detect, daemon=True)
+    detector.start()
+
+    print("[INFO]\tCapturing, move the chessboard through the field of view" +
+          (" (press 'q' to stop, space to force a capture)." if preview else " (Ctrl+C to stop)."))
+
+    next_time = time.perf_counter()
+    try:
+        while not stop.is_set():
+            successful, frame = cap.read()
+            if not successful:
+                print("[WARNING]\tStream ended.")
+                break
+            latest.push(frame)
+
+            if preview:
+                display = frame.copy()
+                color = (0, 255, 0) if status['detected'] else (0, 0, 255)
+                cv2.putText(display, f"{len(captured)}/{target_count}", (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, color, 2)
+                cv2.imshow('Live Calibration', display)
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q'):
+                    break
+                if key == ord(' '):
+                    capture(latest.count - 1, frame, "manual")
+
+            if frame_time:
+                # Pace recordings like a live camera
+                next_time += frame_time
+                time.sleep(max(next_time - time.perf_counter(), 0))
+    except KeyboardInterrupt:
+        print("[INFO]\tCapture stopped.")
+    finally:
+        stop.set()
+        detector.join()
+        cap.release()
+        if preview:
+            cv2.destroyAllWindows()
+
+    if errors:
+        raise errors[0]
+
+    print(f"[INFO]\tAnalysed {status['analysed']} of {latest.count} frames.")
+    return captured
@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import time
+import zlib
+
+# Files are checksummed in blocks, so large outputs are never read into memory at once
+_CHECKSUM_BLOCK = 1 << 20
+
+
+def buffer_checksum(data):
+    # CRC32 of an encoded buffer as 8 hex digits, the same value as file_checksum of the written file
+    return f"{zlib.crc32(data):08x}"
+
+
+def file_checksum(file_path):
+    # CRC32 of the file content as 8 hex digits
+    crc = 0
+    with open(file_path, 'rb') as file:
+        while True:
+            block = file.read(_CHECKSUM_BLOCK)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    return f"{crc:08x}"
+
+
+class ChecksumWriter:
+    """
+    Binary file wrapper computing the CRC32 of everything written through it, for outputs that
+    are written in pieces (e.g. np.save, point clouds) instead of from one encoded buffer.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.crc = 0
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        return self.file.write(data)
+
+    @property
+    def checksum(self):
+        return f"{self.crc:08x}"
+
+
+def parse_id_range(text):
+    """
+    Parse an id range given on the command line, used as argparse type.
+
+    Args:
+    - text: "START:STOP" (STOP excluded), "START:" or ":STOP".
+
+    Returns:
+    - (start, stop), stop is None if open-ended.
+    """
+    start, separator, stop = text.partition(':')
+    try:
+        if not separator:
+            raise ValueError
+        start = int(start) if start else 0
+        stop = int(stop) if stop else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid id range '{text}', expected START:STOP, START: or :STOP")
+    if start < 0 or (stop is not None and stop <= start):
+        raise argparse.ArgumentTypeError(f"invalid id range '{text}', STOP has to be larger than START")
+    return start, stop
+
+
+def load_manifest(path):
+    """
+    Read the completed ids of a manifest.
+
+    Lines that cannot be parsed, e.g. the last line of a run that crashed while writing, are
+    ignored, so their ids are processed again.
+
+    Returns:
+    - Dict of id -> (list of [path relative to the manifest, size in bytes, checksum or None],
+      settings key or None).
+    """
+    completed = {}
+    if not os.path.isfile(path):
+        return completed
+    with open(path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+                completed[int(record['id'])] = (record['files'], record.get('settings'))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return completed
+
+
+class Manifest:
+    """
+    Index of the completed frame ids of a batch job, to resume it after a crash.
+
+    Every completed id is recorded with the size (and optionally the CRC32) of its output files
+    and the settings key of the run, one JSON line per id
+    ({"id": 12, "files": [[path, size, crc32], ...], "settings": key}) with paths relative to the
+    manifest. Records are buffered and appended every `flush_every` ids or `interval`
+    seconds, so a crash only loses the ids of the last flush period.
+
+    Records of earlier runs are kept, a later record of the same id replaces the earlier one, so
+    runs over different id ranges add up in one manifest. Every flush is a single append, so
+    concurrent runs over disjoint ranges can share the manifest. Only `fresh` starts it anew.
+
+    Checksums are handed over by the writers, which compute them from the bytes they write, so
+    outputs are only read back for ids recorded without them.
+
+    When resuming, an id counts as completed if it was recorded with the settings key of this run,
+    all its recorded files still exist with their recorded size and the run does not request
+    further outputs for it. Checksums are not
+    recomputed on resume, they are kept to validate outputs later.
+    """
+
+    def __init__(self, path, resume=False, checksums=False, fresh=False, settings=None, flush_every=100, interval=10.0):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.resume = resume
+        self.checksums = checksums
+        self.settings = settings
+        self.flush_every = flush_every
+        self.interval = interval
+        self.completed = {} if fresh else load_manifest(path)
+        self.skipped = 0
+        self._pending = []
+        self._last_flush = time.perf_counter()
+        # Unbuffered, so the records of a flush reach the file in one write
+        self._file = open(path, 'wb' if fresh else 'ab', buffering=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _relative(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.root)
+
+    def is_completed(self, frame_id, file_paths=None):
+        files, settings = self.completed.get(frame_id, (None, None))
+        # Outputs produced with other settings are not what this run would write
+        if files is None or settings != self.settings:
+            return False
+        if file_paths is not None and not {self._relative(path) for path in file_paths} <= {file[0] for file in files}:
+            return False
+        for relative_path, size, _ in files:
+            file_path = os.path.join(self.root, relative_path)
+            if not os.path.isfile(file_path) or os.path.getsize(file_path) != size:
+                return False
+        return True
+
+    def pending(self, items, key=None, outputs=None):
+        """
+        Skip the completed items when resuming, otherwise pass all items on.
+
+        Args:
+        - items: Iterable of ids, or of items whose id is returned by key.
+        - key: Function returning the id of an item (default: None, the items are the ids).
+        - outputs: Function returning the output files expected for an item, an item whose
+          recorded files lack one of them is processed again (default: None, not checked).
+
+        Returns:
+        - Generator of the items still to be processed.
+        """
+        for item in items:
+            if self.resume and self.is_completed(item if key is None else key(item), None if outputs is None else outputs(item)):
+                self.skipped += 1
+                continue
+            yield item
+
+    def record(self, frame_id, file_paths, checksums=None):
+        """
+        Mark an id as completed.
+
+        Args:
+        - frame_id: Id of the completed frame.
+        - file_paths: Output files written for it.
+        - checksums: CRC32 of the files as computed by the writers (default: None, the files are
+          read back if checksums are enabled).
+        """
+        if checksums is None:
+            checksums = [None] * len(file_paths)
+        files = []
+        for file_path, checksum in zip(file_paths, checksums):
+            if self.checksums and checksum is None:
+                checksum = file_checksum(file_path)
+            files.append([self._relative(file_path), os.path.getsize(file_path), checksum if self.checksums else None])
+        self.completed[frame_id] = (files, self.settings)
+        self._pending.append(json.dumps({'id': frame_id, 'files': files, 'settings': self.settings}))
+
+        if len(self._pending) >= self.flush_every or time.perf_counter() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(("\n".join(self._pending) + "\n").encode())
+            self._pending = []
+        os.fsync(self._file.fileno())
+        self._last_flush = time.perf_counter()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def add_manifest_arguments(parser):
+    # Shared flags of the resumable batch scripts
+    manifest_mode = parser.add_mutually_exclusive_group()
+    manifest_mode.add_argument('--resume', action='store_true', help="Skip the ids completed by an earlier run according to the manifest (<output>/manifest.jsonl).")
+    manifest_mode.add_argument('--fresh', action='store_true', help="Start a new manifest, dropping the records of earlier runs (by default they are kept).")
+    parser.add_argument('--range', type=parse_id_range, metavar='START:STOP', help="Only process the ids START to STOP-1 (START: or :STOP for open ranges).")
+    parser.add_argument('--checksums', action='store_true', help="Also record the CRC32 of every output file in the manifest.")
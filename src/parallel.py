@@ -0,0 +1,52 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+
+def resolve_workers(workers=None):
+    # Default to one worker per CPU
+    if workers is None:
+        return os.cpu_count() or 1
+    return workers
+
+
+def _init_worker():
+    # Each process works on its own image, avoid oversubscribing the cores with OpenCV threads
+    cv2.setNumThreads(1)
+
+
+def _ordered_map(executor, function, items, window):
+    # Like executor.map, but never has more than <window> items in flight,
+    # so a lazy iterable of images is not pulled into memory all at once
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def process_map(function, items, workers=None):
+    """
+    Apply a function to every item on a pool of worker processes.
+
+    Args:
+    - function: Picklable function taking a single item.
+    - items: Iterable of items, consumed lazily.
+    - workers: Number of worker processes (default: number of CPUs, 1 runs in-process).
+
+    Returns:
+    - Generator of the results in the same order as the items.
+    """
+    workers = resolve_workers(workers)
+
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        yield from _ordered_map(executor, function, items, 2 * workers)
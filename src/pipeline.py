@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+
+_END = object()
+
+
+class Pipeline:
+    """
+    Chain of processing stages connected by bounded queues.
+
+    Every stage is run by its own pool of threads, so reading, computing and writing of
+    different items overlap. OpenCV and NumPy release the GIL in their heavy functions,
+    so the stages scale with the number of cores. Items leave the pipeline in the order
+    they finish, not necessarily in the order they entered.
+    """
+
+    def __init__(self, queue_size=8):
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = {}
+        self.elapsed = 0.0
+
+    def add_stage(self, name, function, workers=1):
+        """
+        Append a stage to the pipeline.
+
+        Args:
+        - name: Name of the stage.
+        - function: Called with every item, its return value is passed to the next stage.
+          Returning None drops the item.
+        - workers: Number of threads running this stage.
+        """
+        self.stages.append((name, function, max(workers, 1)))
+        return self
+
+    def run(self, source):
+        """
+        Feed all items of the source through the stages.
+
+        Per-stage counters are collected in self.stats while running: number of items processed
+        and dropped and the time spent in the stage function, summed over its threads.
+
+        Returns:
+        - Generator of the results of the last stage. An exception raised in any stage
+          stops the pipeline and is re-raised here.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stop = threading.Event()
+        errors = []
+        self.stats = {name: {'workers': workers, 'items': 0, 'dropped': 0, 'busy': 0.0}
+                      for name, _, workers in self.stages}
+        start_time = time.perf_counter()
+
+        def put(q, item):
+            # Bounded put that gives up once the pipeline is stopped
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return _END
+
+        def feed():
+            try:
+                for item in source:
+                    if not put(queues[0], item):
+                        return
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            put(queues[0], _END)
+
+        def work(index, function, remaining, stats):
+            q_in, q_out = queues[index], queues[index + 1]
+            try:
+                while True:
+                    item = get(q_in)
+                    if item is _END:
+                        # Let the other threads of this stage see the end as well
+                        put(q_in, _END)
+                        break
+                    started = time.perf_counter()
+                    result = function(item)
+                    busy = time.perf_counter() - started
+                    with remaining[1]:
+                        stats['items'] += 1
+                        stats['dropped'] += result is None
+                        stats['busy'] += busy
+                    if result is not None and not put(q_out, result):
+                        break
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                with remaining[1]:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    put(q_out, _END)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for index, (name, function, workers) in enumerate(self.stages):
+            remaining = [workers, threading.Lock()]
+            for i in range(workers):
+                threads.append(threading.Thread(target=work, args=(index, function, remaining, self.stats[name]),
+                                                name=f"{name}-{i}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = get(queues[-1])
+                if item is _END:
+                    break
+                yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - start_time
+
+        if errors:
+            raise errors[0]
+
+    def print_stats(self):
+        """
+        Print the throughput of every stage of the last run.
+
+        The utilization is the share of the run time the stage's threads spent working,
+        a stage close to 100% is the bottleneck.
+        """
+        if self.elapsed <= 0:
+            return
+        print("[INFO]\tStage throughput:")
+        print("      \tstage       threads    items  items/s  ms/item  utilization")
+        for name, stats in self.stats.items():
+            items = stats['items']
+            ms_per_item = stats['busy'] / items * 1000 if items else 0
+            utilization = stats['busy'] / (stats['workers'] * self.elapsed) * 100
+            print(f"      \t{name:<10} {stats['workers']:8d} {items:8d} {items / self.elapsed:8.1f} {ms_per_item:8.1f} {utilization:11.0f}%")
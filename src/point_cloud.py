@@ -0,0 +1,138 @@
+import os
+
+import cv2
+import numpy as np
+
+from src.depth import q_depth_from_disparity, reproject_image_to_3d
+from src.manifest import ChecksumWriter
+
+POINT_CLOUD_FORMATS = ['ply', 'npy']
+
+_XYZ_FIELDS = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+_COLOR_FIELDS = [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+
+
+def point_dtype(colored=False):
+    # Packed little-endian vertex record, the same layout is written to PLY and .npy files
+    return np.dtype(_XYZ_FIELDS + (_COLOR_FIELDS if colored else []))
+
+
+def valid_point_mask(disparity, depth, min_disparity=0, max_disparity=None, max_depth=None):
+    """
+    Mask of the pixels that give a usable 3D point.
+
+    Args:
+    - disparity: Disparity map (H x W).
+    - depth: Z coordinate of the reprojection (see src.depth.q_depth_from_disparity).
+    - min_disparity: Disparities at or below this value are invalid (default: 0).
+    - max_disparity: Disparities above this value are invalid (default: None, no limit).
+    - max_depth: Points farther away are dropped (default: None, no limit).
+
+    Returns:
+    - Boolean mask (H x W).
+    """
+    with np.errstate(invalid='ignore'):
+        mask = np.greater(disparity, min_disparity)
+        if max_disparity is not None:
+            mask &= np.less_equal(disparity, max_disparity)
+        mask &= np.isfinite(depth)
+        mask &= depth > 0
+        if max_depth is not None:
+            mask &= depth <= max_depth
+    return mask
+
+
+def _ply_header(num_points, colored):
+    lines = [
+        "ply",
+        "format binary_little_endian 1.0",
+        f"element vertex {num_points}",
+        "property float x",
+        "property float y",
+        "property float z",
+    ]
+    if colored:
+        lines += ["property uchar red", "property uchar green", "property uchar blue"]
+    lines.append("end_header")
+    return ("\n".join(lines) + "\n").encode('ascii')
+
+
+def _point_blocks(disparity, Q, mask, colors, dtype, rows):
+    # Reproject and pack blocks of rows, the full H x W x 3 array is never built
+    xyz = np.empty((rows, disparity.shape[1], 3), dtype=np.float32)
+    for start in range(0, disparity.shape[0], rows):
+        stop = min(start + rows, disparity.shape[0])
+        block_mask = mask[start:stop]
+        num_points = np.count_nonzero(block_mask)
+        if num_points == 0:
+            continue
+
+        block_xyz = reproject_image_to_3d(disparity[start:stop], Q, xyz[:stop - start], start)[block_mask]
+
+        block = np.empty(num_points, dtype=dtype)
+        block['x'] = block_xyz[:, 0]
+        block['y'] = block_xyz[:, 1]
+        block['z'] = block_xyz[:, 2]
+        if colors is not None:
+            block_colors = colors[start:stop][block_mask]
+            # Images are BGR
+            block['red'] = block_colors[:, 2]
+            block['green'] = block_colors[:, 1]
+            block['blue'] = block_colors[:, 0]
+        yield block
+
+
+def save_point_cloud(path, disparity, Q, colors=None, min_disparity=0, max_disparity=None, max_depth=None,
+                     rows=128, depth=None, checksum=False):
+    """
+    Reproject a disparity map with the Q matrix and save the valid points as binary PLY or .npy.
+
+    The points are written in blocks of rows, so the memory needed does not depend on the
+    number of points. The .npy file holds a structured array with the fields x, y, z
+    (and red, green, blue), the same records as the PLY vertices.
+
+    Args:
+    - path: Output path, the extension (.ply or .npy) selects the format.
+    - disparity: Disparity map (H x W), any numeric dtype (may be memory-mapped).
+    - Q: 4x4 Q matrix from cv2.stereoRectify.
+    - colors: Rectified left image (H x W x 3, BGR, or H x W gray) to colour the points (default: None).
+    - min_disparity, max_disparity, max_depth: Limits of valid points (see valid_point_mask).
+    - rows: Number of image rows reprojected at once (default: 128).
+    - depth: Already computed Z coordinates of the map, to avoid computing them again (default: None).
+    - checksum: Also return the CRC32 of the written file (default: False).
+
+    Returns:
+    - The number of points written, with checksum (number of points, CRC32 as 8 hex digits).
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in ('.ply', '.npy'):
+        raise ValueError(f"Unsupported point cloud format: {path} (use .ply or .npy)")
+
+    Q = np.asarray(Q, dtype=np.float64)
+    if depth is None:
+        depth = q_depth_from_disparity(disparity, Q)
+
+    if colors is not None:
+        if colors.shape[:2] != disparity.shape:
+            print(f"[WARNING]\tColour image size {colors.shape[1]}x{colors.shape[0]} does not match the disparity map, saving {path} without colour.")
+            colors = None
+        elif colors.ndim == 2:
+            colors = cv2.cvtColor(colors, cv2.COLOR_GRAY2BGR)
+
+    mask = valid_point_mask(disparity, depth, min_disparity, max_disparity, max_depth)
+    num_points = int(np.count_nonzero(mask))
+    dtype = point_dtype(colors is not None)
+    blocks = _point_blocks(disparity, Q, mask, colors, dtype, rows)
+
+    # Both formats are a header followed by the records, written block by block
+    with open(path, 'wb') as file:
+        writer = ChecksumWriter(file) if checksum else file
+        if extension == '.ply':
+            writer.write(_ply_header(num_points, colors is not None))
+        else:
+            header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (num_points,)}
+            np.lib.format.write_array_header_1_0(writer, header)
+        for block in blocks:
+            writer.write(block.tobytes())
+
+    return (num_points, writer.checksum) if checksum else num_points
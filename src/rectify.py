@@ -0,0 +1,82 @@
+import cv2
+import numpy as np
+
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+STEREO_MAP_ARRAYS = ['stereo_map_l_x', 'stereo_map_l_y', 'stereo_map_r_x', 'stereo_map_r_y', 'roi_l', 'roi_r']
+
+
+def common_roi(roi_l, roi_r):
+    # Intersection of both valid regions, cropping both images identically keeps the rows
+    # aligned and the disparities unchanged
+    x_l, y_l, w_l, h_l = (int(v) for v in np.ravel(roi_l))
+    x_r, y_r, w_r, h_r = (int(v) for v in np.ravel(roi_r))
+    x0, y0 = max(x_l, x_r), max(y_l, y_r)
+    x1, y1 = min(x_l + w_l, x_r + w_r), min(y_l + h_l, y_r + h_r)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def cropped_q_matrix(Q, roi):
+    # Moving the origin to the crop corner shifts the principal point, depth is unchanged
+    Q = np.array(Q, dtype=np.float64)
+    if roi is not None:
+        Q[0, 3] += roi[0]
+        Q[1, 3] += roi[1]
+    return Q
+
+
+def _fixed_point_maps(map_x, map_y, interpolation):
+    map_x = np.asarray(map_x)
+    map_y = np.asarray(map_y)
+
+    if interpolation == cv2.INTER_NEAREST:
+        # Rounded integer coordinates, the interpolation table is not needed
+        if map_x.dtype == np.int16:
+            map_x, map_y = cv2.convertMaps(map_x, map_y, cv2.CV_32FC1)
+        map_xy, _ = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2, nninterpolation=True)
+        return map_xy, None
+
+    if map_x.dtype == np.int16:
+        return map_x, map_y
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+class StereoRectifier:
+    """
+    Remaps stereo pairs with rectification maps prepared once for the chosen interpolation.
+
+    Args:
+    - stereo_map: Dictionary with the stereo maps and ROIs (see src.stereo_map.load_stereo_map).
+    - interpolation: One of INTERPOLATIONS (default: lanczos).
+    - crop: Only remap the region valid in both rectified images (default: False). Both images
+      are cropped identically, the principal points shift by the crop offset.
+    """
+
+    def __init__(self, stereo_map, interpolation='lanczos', crop=False):
+        self.interpolation = INTERPOLATIONS[interpolation]
+        self.roi = None
+
+        map_l_x, map_l_y = stereo_map['stereo_map_l_x'], stereo_map['stereo_map_l_y']
+        map_r_x, map_r_y = stereo_map['stereo_map_r_x'], stereo_map['stereo_map_r_y']
+
+        if crop:
+            x, y, w, h = common_roi(stereo_map['roi_l'], stereo_map['roi_r'])
+            if w > 0 and h > 0:
+                self.roi = (x, y, w, h)
+                map_l_x, map_l_y = map_l_x[y:y + h, x:x + w], map_l_y[y:y + h, x:x + w]
+                map_r_x, map_r_y = map_r_x[y:y + h, x:x + w], map_r_y[y:y + h, x:x + w]
+            else:
+                print("[WARNING]\tThe valid regions of the rectified images do not overlap, not cropping.")
+
+        self.map_l = _fixed_point_maps(np.ascontiguousarray(map_l_x), np.ascontiguousarray(map_l_y), self.interpolation)
+        self.map_r = _fixed_point_maps(np.ascontiguousarray(map_r_x), np.ascontiguousarray(map_r_y), self.interpolation)
+
+    def rectify(self, img_l, img_r):
+        rect_img_l = cv2.remap(img_l, self.map_l[0], self.map_l[1], self.interpolation, cv2.BORDER_CONSTANT, 0)
+        rect_img_r = cv2.remap(img_r, self.map_r[0], self.map_r[1], self.interpolation, cv2.BORDER_CONSTANT, 0)
+        return rect_img_l, rect_img_r
@@ -0,0 +1,143 @@
+import cv2
+import numpy as np
+
+
+def rotation_matrices(rvecs):
+    """
+    Rodrigues formula for all views at once.
+
+    Args:
+    - rvecs: Rotation vectors (V x 3, or a sequence of 3x1 vectors as returned by cv2.calibrateCamera).
+
+    Returns:
+    - Rotation matrices (V x 3 x 3).
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    axis = np.divide(rvecs, theta[:, np.newaxis], out=np.zeros_like(rvecs), where=theta[:, np.newaxis] > 0)
+
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:, 0, 1], K[:, 0, 2] = -axis[:, 2], axis[:, 1]
+    K[:, 1, 0], K[:, 1, 2] = axis[:, 2], -axis[:, 0]
+    K[:, 2, 0], K[:, 2, 1] = -axis[:, 1], axis[:, 0]
+
+    sin = np.sin(theta)[:, np.newaxis, np.newaxis]
+    cos = np.cos(theta)[:, np.newaxis, np.newaxis]
+    return np.eye(3) + sin * K + (1 - cos) * (K @ K)
+
+
+def per_view_errors(object_points, image_points, rvecs, tvecs, camera_matrix, distortion_coeffs):
+    """
+    RMS reprojection error of every view, with a single batched projection of all points.
+
+    The board points are moved into the camera frame of their view with NumPy and projected
+    with one cv2.projectPoints call (identity pose), instead of one call per view.
+
+    Args:
+    - object_points: Board points per view (sequence of N x 3).
+    - image_points: Detected corners per view (sequence of N x 2 or N x 1 x 2).
+    - rvecs, tvecs: Board poses per view, as returned by cv2.calibrateCamera.
+    - camera_matrix, distortion_coeffs: Intrinsics.
+
+    Returns:
+    - RMS error per view in pixels (V,).
+    """
+    object_points = np.stack([np.asarray(points, dtype=np.float64).reshape(-1, 3) for points in object_points])
+    image_points = np.stack([np.asarray(points, dtype=np.float64).reshape(-1, 2) for points in image_points])
+    num_views, num_points = object_points.shape[:2]
+
+    rotations = rotation_matrices(rvecs)
+    translations = np.asarray(tvecs, dtype=np.float64).reshape(-1, 1, 3)
+    camera_points = object_points @ rotations.transpose(0, 2, 1) + translations
+
+    projected, _ = cv2.projectPoints(camera_points.reshape(-1, 1, 3), np.zeros(3), np.zeros(3), camera_matrix, distortion_coeffs)
+    residuals = projected.reshape(num_views, num_points, 2) - image_points
+    return np.sqrt(np.mean(np.sum(residuals ** 2, axis=2), axis=1))
+
+
+def calibrate_with_pruning(object_points, image_points, image_size, outlier_factor=2.0, max_view_error=None, min_views=5,
+                           min_error=0.25, flags=0, criteria=None, camera_matrix=None, distortion_coeffs=None):
+    """
+    Calibrate a camera and iteratively drop the worst view while it is an outlier.
+
+    A view is an outlier if its RMS error is above outlier_factor times the median error of the
+    remaining views, or above max_view_error. Views below min_error are never outliers, on very
+    clean data the relative threshold would otherwise drop good views. After each dropped view
+    the solver is restarted from the previous intrinsics (cv2.CALIB_USE_INTRINSIC_GUESS), the
+    corners are reused, so a refit only costs solver time.
+
+    Args:
+    - object_points, image_points: Board points and detected corners per view.
+    - image_size: (width, height) of the images.
+    - outlier_factor: Relative outlier threshold, None disables it (default: 2.0).
+    - max_view_error: Absolute outlier threshold in pixels (default: None).
+    - min_views: Never drop below this number of views (default: 5).
+    - min_error: RMS error in pixels below which a view is always kept (default: 0.25).
+    - flags, criteria: Passed to cv2.calibrateCamera.
+    - camera_matrix, distortion_coeffs: Initial intrinsics, e.g. of an earlier calibration of the
+      same camera. The first fit then starts from them (default: None, solve from scratch).
+
+    Returns:
+    - rmse: RMS reprojection error of the final fit.
+    - camera_matrix, distortion_coeffs: Intrinsics of the final fit.
+    - view_errors: RMS error per input view; for dropped views the error when they were dropped.
+    - pruned: Indices of the dropped views, in the order they were dropped.
+    """
+    kept = np.arange(len(object_points))
+    view_errors = np.zeros(len(object_points))
+    pruned = []
+
+    def fit(views, camera_matrix=None, distortion_coeffs=None, fit_flags=flags):
+        arguments = ([object_points[i] for i in views], [image_points[i] for i in views], image_size,
+                     camera_matrix, distortion_coeffs)
+        if criteria is None:
+            return cv2.calibrateCamera(*arguments, flags=fit_flags)
+        return cv2.calibrateCamera(*arguments, flags=fit_flags, criteria=criteria)
+
+    if camera_matrix is None:
+        rmse, camera_matrix, distortion_coeffs, rvecs, tvecs = fit(kept)
+    else:
+        rmse, camera_matrix, distortion_coeffs, rvecs, tvecs = fit(kept, np.array(camera_matrix, dtype=np.float64),
+                                                                   np.array(distortion_coeffs, dtype=np.float64),
+                                                                   flags | cv2.CALIB_USE_INTRINSIC_GUESS)
+
+    while True:
+        errors = per_view_errors([object_points[i] for i in kept], [image_points[i] for i in kept], rvecs, tvecs,
+                                 camera_matrix, distortion_coeffs)
+        view_errors[kept] = errors
+        if len(kept) <= min_views:
+            break
+
+        worst = int(np.argmax(errors))
+        thresholds = []
+        if outlier_factor is not None:
+            thresholds.append(outlier_factor * np.median(errors))
+        if max_view_error is not None:
+            thresholds.append(max_view_error)
+        if not thresholds or errors[worst] <= max(min(thresholds), min_error):
+            break
+
+        pruned.append(int(kept[worst]))
+        kept = np.delete(kept, worst)
+        rmse, camera_matrix, distortion_coeffs, rvecs, tvecs = fit(kept, camera_matrix, distortion_coeffs,
+                                                                   flags | cv2.CALIB_USE_INTRINSIC_GUESS)
+
+    return rmse, camera_matrix, distortion_coeffs, view_errors, pruned
+
+
+def save_view_errors(view_errors, pruned, file_path, names=None):
+    """
+    Write the per-view reprojection errors as CSV (view, name, error_px, status).
+
+    Args:
+    - view_errors: RMS error per view.
+    - pruned: Indices of the dropped views.
+    - file_path: Output CSV path.
+    - names: Name per view, e.g. the image path (default: None).
+    """
+    pruned = set(pruned)
+    with open(file_path, 'w') as file:
+        file.write("view,name,error_px,status\n")
+        for i, error in enumerate(view_errors):
+            name = names[i] if names is not None else ""
+            file.write(f"{i},{name},{error:.4f},{'pruned' if i in pruned else 'used'}\n")
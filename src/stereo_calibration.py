@@ -1,7 +1,10 @@
 import cv2
 import numpy as np
 
-def stereo_calibrate(mtx_l, dist_l, mtx_r, dist_r, images_l, images_r, pattern_size, square_size, visualize=True):
+from src.chessboard_detection import detect_corners
+from src.image_source import read_image
+
+def stereo_calibrate(mtx_l, dist_l, mtx_r, dist_r, images_l, images_r, pattern_size, square_size, visualize=True, workers=None, corner_set_l=None, corner_set_r=None, max_dim=None):
  
     #change this if stereo calibration not good.
     termination_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.0001)
@@ -16,17 +19,21 @@ def stereo_calibrate(mtx_l, dist_l, mtx_r, dist_r, images_l, images_r, pattern_s
  
     object_points = []
  
-    for frame_l, frame_r in zip(images_l, images_r):
-        gray_img_l = cv2.cvtColor(frame_l, cv2.COLOR_BGR2GRAY)
-        gray_image_r = cv2.cvtColor(frame_r, cv2.COLOR_BGR2GRAY)
-        success_l, corners_l = cv2.findChessboardCorners(gray_img_l, pattern_size, None)
-        success_r, corners_r = cv2.findChessboardCorners(gray_image_r, pattern_size, None)
+    # Reuse corners detected during the intrinsic calibration if given
+    if corner_set_l is None:
+        corner_set_l = detect_corners(images_l, pattern_size, termination_criteria, workers, max_dim)
+    if corner_set_r is None:
+        corner_set_r = detect_corners(images_r, pattern_size, termination_criteria, workers, max_dim)
  
+    for i, ((success_l, corners_l), (success_r, corners_r)) in enumerate(zip(corner_set_l, corner_set_r)):
         if success_l == True and success_r == True:
-            corners_l = cv2.cornerSubPix(gray_img_l, corners_l, (11, 11), (-1, -1), termination_criteria)
-            corners_r = cv2.cornerSubPix(gray_image_r, corners_r, (11, 11), (-1, -1), termination_criteria)
-
-            if visualize:
+            if visualize and images_l is not None and images_r is not None:
+                # Image sources and path lists are only read here, for display
+                frame_l, frame_r = images_l[i], images_r[i]
+                if isinstance(frame_l, str):
+                    frame_l = read_image(frame_l)
+                if isinstance(frame_r, str):
+                    frame_r = read_image(frame_r)
 
                 # Draw chessboard corners on both images
                 cv2.drawChessboardCorners(frame_l, pattern_size, corners_l, success_l)
@@ -40,11 +47,14 @@ def stereo_calibrate(mtx_l, dist_l, mtx_r, dist_r, images_l, images_r, pattern_s
             image_points_left.append(corners_l)
             image_points_right.append(corners_r)
 
-    cv2.destroyAllWindows()
+    if visualize:
+        cv2.destroyAllWindows()
  
+    img_size = corner_set_l.image_size
+
     stereocalibration_flags = cv2.CALIB_FIX_INTRINSIC
     rmse, _, _, _, _, R, T, E, F = cv2.stereoCalibrate(object_points, image_points_left, image_points_right, mtx_l, dist_l,
-                                                                 mtx_r, dist_r, gray_img_l.shape[::-1], criteria = termination_criteria, flags = stereocalibration_flags)
+                                                                 mtx_r, dist_r, img_size, criteria = termination_criteria, flags = stereocalibration_flags)
  
     print("Rotation Matrix:\n", R)
     print("Translation Vector:\n", T)
@@ -0,0 +1,92 @@
+import os
+
+import cv2
+import numpy as np
+
+STEREO_MAP_KEYS = ['P_l', 'P_r', 'Q', 'stereo_map_l_x', 'stereo_map_l_y', 'stereo_map_r_x', 'stereo_map_r_y', 'roi_l', 'roi_r']
+
+
+def stereo_map_xml_path(name, folder="data/out"):
+    return os.path.join(folder, f"stereo_map_{name}.xml")
+
+
+def stereo_map_binary_path(name, folder="data/out"):
+    # One raw .npy file per array, which can be memory-mapped instead of parsed
+    return os.path.join(folder, f"stereo_map_{name}")
+
+
+def save_stereo_map(name, arrays, folder="data/out"):
+    """
+    Save the rectification data as XML and, alongside, as a folder of .npy files.
+
+    Args:
+    - name: Name of the calibration.
+    - arrays: Dictionary with the entries of STEREO_MAP_KEYS.
+    - folder: Output folder (default: data/out).
+    """
+    cv_file = cv2.FileStorage(stereo_map_xml_path(name, folder), cv2.FILE_STORAGE_WRITE)
+    for key in STEREO_MAP_KEYS:
+        cv_file.write(key, arrays[key])
+    cv_file.release()
+
+    save_stereo_map_binary(name, arrays, folder)
+
+
+def save_stereo_map_binary(name, arrays, folder="data/out"):
+    binary_path = stereo_map_binary_path(name, folder)
+    os.makedirs(binary_path, exist_ok=True)
+    for key in STEREO_MAP_KEYS:
+        array = np.ascontiguousarray(arrays[key])
+        if key.startswith('roi'):
+            # (x, y, width, height)
+            array = array.reshape(4).astype(np.int32)
+        np.save(os.path.join(binary_path, f"{key}.npy"), array)
+
+
+def _binary_is_current(name, folder):
+    # The binary copy is only used if it is complete and not older than the XML file
+    binary_path = stereo_map_binary_path(name, folder)
+    files = [os.path.join(binary_path, f"{key}.npy") for key in STEREO_MAP_KEYS]
+    if not all(os.path.isfile(file) for file in files):
+        return False
+
+    xml_path = stereo_map_xml_path(name, folder)
+    if not os.path.isfile(xml_path):
+        return True
+    return min(os.path.getmtime(file) for file in files) >= os.path.getmtime(xml_path)
+
+
+def load_stereo_map(name, keys=STEREO_MAP_KEYS, folder="data/out"):
+    """
+    Load rectification data, memory-mapping the binary copy if available.
+
+    If only the XML file exists (e.g. from an older calibration), it is parsed once and the
+    binary copy is written next to it, so later runs start without parsing the XML.
+
+    Args:
+    - name: Name of the calibration.
+    - keys: Entries to load (default: all).
+    - folder: Folder containing the calibration files (default: data/out).
+
+    Returns:
+    - Dictionary with the requested arrays.
+    """
+    if _binary_is_current(name, folder):
+        binary_path = stereo_map_binary_path(name, folder)
+        return {key: np.load(os.path.join(binary_path, f"{key}.npy"), mmap_mode='r') for key in keys}
+
+    xml_path = stereo_map_xml_path(name, folder)
+    if not os.path.isfile(xml_path):
+        raise FileNotFoundError(f"Calibration file not found: {xml_path}")
+
+    cv_file = cv2.FileStorage(xml_path, cv2.FILE_STORAGE_READ)
+    arrays = {key: cv_file.getNode(key).mat() for key in STEREO_MAP_KEYS}
+    cv_file.release()
+
+    try:
+        save_stereo_map_binary(name, arrays, folder)
+        print(f"[INFO]\tConverted {xml_path} to binary rectification maps.")
+    except OSError as e:
+        print(f"[WARNING]\tCould not write binary rectification maps: {e}")
+
+    return {key: arrays[key] for key in keys}
@@ -0,0 +1,117 @@
+import threading
+
+import cv2
+import numpy as np
+
+SGBM_MODES = {
+    'sgbm': cv2.STEREO_SGBM_MODE_SGBM,
+    'hh': cv2.STEREO_SGBM_MODE_HH,
+    'sgbm3way': cv2.STEREO_SGBM_MODE_SGBM_3WAY,
+    'hh4': cv2.STEREO_SGBM_MODE_HH4,
+}
+
+
+def create_matcher(num_disparities=128, block_size=5, min_disparity=0, mode='sgbm', channels=1):
+    """
+    Create a cv2.StereoSGBM matcher with the usual smoothness penalties for the block size.
+
+    Args:
+    - num_disparities: Disparity search range, rounded up to a multiple of 16 (default: 128).
+    - block_size: Odd matched block size (default: 5).
+    - min_disparity: Smallest searched disparity (default: 0).
+    - mode: One of SGBM_MODES (default: sgbm).
+    - channels: Number of channels of the matched images (default: 1).
+
+    Returns:
+    - The matcher.
+    """
+    num_disparities = max(16, -(-num_disparities // 16) * 16)
+    return cv2.StereoSGBM_create(
+        minDisparity=min_disparity,
+        numDisparities=num_disparities,
+        blockSize=block_size,
+        P1=8 * channels * block_size ** 2,
+        P2=32 * channels * block_size ** 2,
+        disp12MaxDiff=1,
+        uniquenessRatio=10,
+        speckleWindowSize=100,
+        speckleRange=2,
+        mode=SGBM_MODES[mode],
+    )
+
+
+class DisparityMatcher:
+    """
+    Computes float32 disparity maps of rectified pairs with StereoSGBM.
+
+    Every thread calling compute gets its own matcher instance, so one DisparityMatcher can be
+    shared by all workers of a pipeline stage. Pixels without a valid match are NaN.
+
+    Args:
+    - scale: Match on images downscaled by this factor (default: 1.0). The disparities are
+      upsampled to the input resolution, interpolating only valid matches, and rescaled to
+      full-resolution pixels.
+    - num_disparities, block_size, min_disparity, mode: Matcher settings at full resolution
+      (see create_matcher). The disparity range is scaled along with the images.
+    """
+
+    def __init__(self, scale=1.0, num_disparities=128, block_size=5, min_disparity=0, mode='sgbm'):
+        if not 0 < scale <= 1:
+            raise ValueError(f"Matching scale must be in (0, 1], got {scale}")
+        self.scale = scale
+        self.settings = {
+            'num_disparities': max(1, round(num_disparities * scale)),
+            'block_size': block_size,
+            'min_disparity': int(np.floor(min_disparity * scale)),
+            'mode': mode,
+        }
+        self._local = threading.local()
+
+    def _matcher(self, channels):
+        matchers = getattr(self._local, 'matchers', None)
+        if matchers is None:
+            matchers = self._local.matchers = {}
+        if channels not in matchers:
+            matchers[channels] = create_matcher(channels=channels, **self.settings)
+        return matchers[channels]
+
+    def compute(self, img_l, img_r):
+        """
+        Args:
+        - img_l, img_r: Rectified left and right image (gray or BGR).
+
+        Returns:
+        - Disparity map of the left image in pixels (float32, input resolution).
+        """
+        height, width = img_l.shape[:2]
+        if self.scale != 1:
+            size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+            img_l = cv2.resize(img_l, size, interpolation=cv2.INTER_AREA)
+            img_r = cv2.resize(img_r, size, interpolation=cv2.INTER_AREA)
+
+        matcher = self._matcher(1 if img_l.ndim == 2 else img_l.shape[2])
+        # Fixed-point result with 4 fractional bits, invalid pixels are (minDisparity - 1) * 16
+        raw = matcher.compute(img_l, img_r)
+        invalid = raw < matcher.getMinDisparity() * 16
+
+        disparity = raw.astype(np.float32)
+        disparity *= 1 / (16 * self.scale)
+
+        if self.scale != 1:
+            return _upsample_valid(disparity, invalid, (width, height))
+
+        disparity[invalid] = np.nan
+        return disparity
+
+
+def _upsample_valid(disparity, invalid, size):
+    # Only valid disparities are interpolated: values and validity are upsampled alike and the
+    # values are renormalized by the valid weight, pixels mostly covered by invalid ones are NaN
+    valid = (~invalid).astype(np.float32)
+    disparity[invalid] = 0
+    weight = cv2.resize(valid, size, interpolation=cv2.INTER_LINEAR)
+    disparity = cv2.resize(disparity, size, interpolation=cv2.INTER_LINEAR)
+    mask = weight > 0.5
+    disparity[mask] /= weight[mask]
+    disparity[~mask] = np.nan
+    return disparity
@@ -0,0 +1,171 @@
+import cv2
+import numpy as np
+
+import argparse
+import os
+
+from rectification import list_pairs, load_rectifier, pair_reader, pair_writer, video_pairs
+from src.depth import depth_from_disparity, projection_depth_constants, q_depth_from_disparity, save_depth_map, save_heatmap
+from src.instrumentation import add_instrumentation_arguments, enable_from_args, metrics
+from src.parallel import resolve_workers
+from src.pipeline import Pipeline
+from src.point_cloud import POINT_CLOUD_FORMATS, save_point_cloud
+from src.rectify import INTERPOLATIONS, cropped_q_matrix
+from src.stereo_map import load_stereo_map
+from src.stereo_matching import SGBM_MODES, DisparityMatcher
+
+def frame_writer(output_folder, save_rectified=False, save_disparity=False, save_depth=False, save_heatmap_image=False,
+                 point_cloud=None, Q=None, cloud_options=None):
+    """
+    Create the function of the write stage, saving only the requested products of a frame.
+
+    Products are written to the folder layout of the separate scripts: rectified/ as written by
+    rectification.py, disparity/rectified_left_<N>.npy and depth/<N>_depth.tif, <N>_heatmap.png,
+    <N>_points.<ply|npy> as written by disparity_to_depth.py.
+    """
+    save_pair = pair_writer(f"{output_folder}/rectified") if save_rectified else None
+    if save_disparity:
+        os.makedirs(f"{output_folder}/disparity", exist_ok=True)
+    if save_depth or save_heatmap_image or point_cloud:
+        os.makedirs(f"{output_folder}/depth", exist_ok=True)
+
+    def save_frame(frame):
+        counter, rect_img_l, rect_img_r, disparity, depth_map = frame
+
+        if save_pair is not None:
+            save_pair((counter, rect_img_l, rect_img_r))
+        if save_disparity:
+            np.save(f"{output_folder}/disparity/rectified_left_{counter}.npy", disparity)
+        if save_depth:
+            save_depth_map(depth_map, f"{output_folder}/depth/{counter}_depth.tif")
+        if save_heatmap_image:
+            save_heatmap(depth_map, f"{output_folder}/depth/{counter}_heatmap.png")
+        if point_cloud:
+            save_point_cloud(f"{output_folder}/depth/{counter}_points.{point_cloud}", disparity, Q, rect_img_l,
+                             **(cloud_options or {}))
+        return counter
+
+    return save_frame
+
+def main(args):
+    workers = resolve_workers(args.workers)
+
+    # Rectification, matching and depth settings as in rectification.py, disparity.py and disparity_to_depth.py
+    rectifier = load_rectifier(args.name, args.interpolation, args.crop)
+    matcher = DisparityMatcher(args.scale, args.num_disparities, args.block_size, args.min_disparity, args.mode)
+
+    calibration = load_stereo_map(args.name, ['P_l', 'P_r', 'Q'])
+    focal_baseline, offset = projection_depth_constants(np.array(calibration['P_l']), np.array(calibration['P_r']))
+    Q = cropped_q_matrix(calibration['Q'], rectifier.roi)
+
+    def rectify_pair(pair):
+        counter, img_l, img_r = pair
+        rect_img_l, rect_img_r = rectifier.rectify(img_l, img_r)
+        return counter, rect_img_l, rect_img_r
+
+    def match_pair(pair):
+        counter, rect_img_l, rect_img_r = pair
+        if args.color:
+            disparity = matcher.compute(rect_img_l, rect_img_r)
+        else:
+            disparity = matcher.compute(cv2.cvtColor(rect_img_l, cv2.COLOR_BGR2GRAY), cv2.cvtColor(rect_img_r, cv2.COLOR_BGR2GRAY))
+        # The right image is only kept if it is saved
+        return counter, rect_img_l, rect_img_r if args.save_rectified else None, disparity
+
+    def convert_depth(frame):
+        counter, rect_img_l, rect_img_r, disparity = frame
+        if args.use_q:
+            depth_map = q_depth_from_disparity(disparity, Q)
+        else:
+            depth_map = depth_from_disparity(disparity, focal_baseline, offset)
+        return counter, rect_img_l, rect_img_r, disparity, depth_map
+
+    cloud_options = {
+        'min_disparity': args.min_cloud_disparity,
+        'max_disparity': args.max_cloud_disparity,
+        'max_depth': args.max_depth,
+    }
+    save_frame = frame_writer(args.out, args.save_rectified, args.save_disparity, not args.no_depth, not args.no_heatmap,
+                              args.point_cloud, Q, cloud_options)
+
+    # Every pair stays in memory from reading to writing, bounded queues limit the frames in flight
+    pipeline = Pipeline(queue_size=2 * workers)
+    if args.video is None:
+        pipeline.add_stage("read", pair_reader(args.left, args.right), args.io_threads)
+    pipeline.add_stage("remap", rectify_pair, workers)
+    pipeline.add_stage("match", match_pair, workers)
+    pipeline.add_stage("depth", convert_depth, workers)
+    pipeline.add_stage("write", save_frame, args.io_threads)
+
+    if args.video is None:
+        source = list_pairs(args.left, args.right)
+    else:
+        cap = cv2.VideoCapture(args.video)
+        if not cap.isOpened():
+            print(f"[ERROR]\tCannot open video file: {args.video}")
+            return
+        source = video_pairs(cap)
+
+    counter = 0
+
+    print("[INFO]\tProcessing stereo pairs...\n")
+
+    try:
+        for _ in pipeline.run(source):
+            counter += 1
+            metrics.progress()
+            if counter % 10 == 0:
+                print(f"      \t... Processed {counter} pairs...", end="\r")
+    finally:
+        if args.video is not None:
+            cap.release()
+
+    print("                                                                                    ", end="\r")
+    print(f"[INFO]\t... Processing of {counter} stereo pairs complete!")
+    pipeline.print_stats()
+    metrics.record_pipeline(pipeline)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rectify stereo pairs, compute disparities and depth in one in-memory pipeline.")
+    parser.add_argument('-n', '--name', default="new", help="Name identifier for the stereo rectification maps (default: new).")
+    parser.add_argument('-l', '--left', help="Input folder containing the left images.")
+    parser.add_argument('-r', '--right', help="Input folder containing the right images.")
+    parser.add_argument('-v', '--video', help="Side-by-side stereo video, instead of image folders.")
+    parser.add_argument('-o', '--out', required=True, help="Output folder for the requested products.")
+    parser.add_argument('-w', '--workers', type=int, help="Number of threads per compute stage (default: number of CPUs).")
+    parser.add_argument('--io-threads', type=int, default=2, help="Number of threads reading and writing each (default: 2).")
+    # Products, by default only depth maps and heatmaps are saved
+    parser.add_argument('--save-rectified', action='store_true', help="Save the rectified images (rectified/).")
+    parser.add_argument('--save-disparity', action='store_true', help="Save the disparity maps (disparity/rectified_left_<N>.npy).")
+    parser.add_argument('--no-depth', action='store_true', help="Do not save the depth maps (depth/<N>_depth.tif).")
+    parser.add_argument('--no-heatmap', action='store_true', help="Do not save the heatmaps (depth/<N>_heatmap.png).")
+    parser.add_argument('-p', '--point-cloud', choices=POINT_CLOUD_FORMATS, help="Save coloured point clouds (depth/<N>_points.ply or .npy).")
+    # Rectification
+    parser.add_argument('-i', '--interpolation', choices=list(INTERPOLATIONS), default='lanczos', help="Interpolation used for remapping (default: lanczos).")
+    parser.add_argument('-c', '--crop', action='store_true', help="Crop the rectified images to the region valid in both images.")
+    # Matching
+    parser.add_argument('-s', '--scale', type=float, default=1.0, help="Match on images downscaled by this factor (default: 1.0).")
+    parser.add_argument('-d', '--num-disparities', type=int, default=128, help="Disparity search range in full-resolution pixels (default: 128).")
+    parser.add_argument('-b', '--block-size', type=int, default=5, help="Odd matched block size (default: 5).")
+    parser.add_argument('--min-disparity', type=int, default=0, help="Smallest searched disparity in full-resolution pixels (default: 0).")
+    parser.add_argument('-m', '--mode', choices=list(SGBM_MODES), default='sgbm', help="StereoSGBM mode (default: sgbm).")
+    parser.add_argument('--color', action='store_true', help="Match the colour images instead of grayscale.")
+    # Depth
+    parser.add_argument('-q', '--use_q', action='store_true', help="Use Q matrix method (default: projection matrices).")
+    parser.add_argument('--min-cloud-disparity', type=float, default=0, help="Point clouds: drop disparities at or below this value (default: 0).")
+    parser.add_argument('--max-cloud-disparity', type=float, help="Point clouds: drop disparities above this value (default: no limit).")
+    parser.add_argument('--max-depth', type=float, help="Point clouds: drop points farther away than this depth (default: no limit).")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    if args.video is None and (args.left is None or args.right is None):
+        parser.error("the following arguments are required: -l/--left, -r/--right (or -v/--video)")
+    if args.no_depth and args.no_heatmap and not (args.save_rectified or args.save_disparity or args.point_cloud):
+        parser.error("nothing to save, all products are disabled")
+
+    enable_from_args("stereo_pipeline", args)
+    main(args)
+    metrics.close()
+
+# Example Usage:
+# python stereo_pipeline.py -n run_2 -l "D:\fft out\start_dataset\Stereo_images_left" -r "D:\fft out\start_dataset\Stereo_images_right" -o "D:\fft out\start_dataset\depth" -s 0.5